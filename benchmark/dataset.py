@@ -0,0 +1,63 @@
+import json
+import shutil
+from pathlib import Path
+
+source_path = Path(__file__).resolve().parent.parent / 'data'
+
+
+def generate_data_root(root_path: Path, item_count: int=10000, group_size: int=20, signage_count: int=100,
+                       scene_count: int=5) -> Path:
+    # templates, media and the signage page are copied from the repository data.
+    # menu items, menu groups, signages and channels are generated.
+    shutil.copytree(str(source_path / 'template'), str(root_path / 'template'))
+    shutil.copytree(str(source_path / 'media' / 'image'), str(root_path / 'media' / 'image'))
+    (root_path / 'media' / 'video').mkdir()
+    # signages are generated. libraries in the vendor directory are copied.
+    shutil.copytree(str(source_path / 'signage'), str(root_path / 'signage'),
+                    ignore=lambda path, names: [x for x in names if x.endswith('.json')]
+                    if Path(path) == source_path / 'signage' else [])
+    (root_path / 'channel').mkdir()
+
+    for type_id in ['menu_item', 'menu_group']:
+        (root_path / 'data' / type_id).mkdir(parents=True)
+        shutil.copy2(str(source_path / 'data' / type_id / 'manifest.json'), str(root_path / 'data' / type_id))
+
+    for index in range(item_count):
+        _write_json(root_path / 'data' / 'menu_item' / 'item{}.json'.format(index),
+                    {'name': 'Item {}'.format(index), 'price': 100 + index % 900})
+
+    group_count = (item_count + group_size - 1) // group_size
+    for index in range(group_count):
+        menus = ['item{}'.format(x) for x in range(index * group_size, min((index + 1) * group_size, item_count))]
+        _write_json(root_path / 'data' / 'menu_group' / 'group{}.json'.format(index),
+                    {'name': 'Group {}'.format(index), 'menus': menus, 'digits': 2,
+                     'price_prefix': '$', 'price_postfix': ''})
+
+    for index in range(signage_count):
+        scenes = [_menu_group_scene('group{}'.format((index + x) % group_count)) for x in range(scene_count)]
+        _write_json(root_path / 'signage' / 'signage{}.json'.format(index), {
+            'title': 'Signage {}'.format(index),
+            'description': 'generated signage',
+            'frame': {'id': 'bottom_clock',
+                      'data': {'close_enabled': True, 'close_str': 'CLOSE AT', 'close_time': '2017-01-01 22:00'}},
+            'scenes': scenes
+        })
+        _write_json(root_path / 'channel' / 'channel{}.json'.format(index),
+                    {'description': 'generated channel', 'signage': 'signage{}'.format(index)})
+
+    return root_path
+
+
+def _menu_group_scene(group_id: str) -> dict:
+    return {
+        'id': 'menu_group_scene',
+        'duration': 10,
+        'transition': 'NONE',
+        'scheduling': {'type': 'ALWAYS_VISIBLE', 'from': '0:0:0', 'to': '23:59:59', 'day_of_week': [True] * 7},
+        'data': {'bullet': '*', 'hide_menu_group_name': False, 'menu_group': group_id}
+    }
+
+
+def _write_json(path: Path, data: dict) -> None:
+    with path.open('w', encoding='UTF-8') as f:
+        f.write(json.dumps(data))
@@ -0,0 +1,94 @@
+import argparse
+import multiprocessing
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))
+
+
+def run_server(root_path: Path, async_mode: str, port: int, workers: int) -> None:
+    # green threads replace blocking calls of the process. patch before the server modules are imported.
+    if async_mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif async_mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+    from controller.manager import load_managers
+    from webserver.web_server import WebServer
+
+    managers = load_managers(root_path)
+    WebServer(managers.chn_mng, managers.obj_mng, managers.tpl_mng, managers.sgn_mng, managers.mtm_mng,
+              async_mode).serve('127.0.0.1', port, workers)
+
+
+def wait_for_server(url: str, server: multiprocessing.Process, timeout: float=30) -> None:
+    deadline = time.perf_counter() + timeout
+
+    while True:
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except OSError:
+            if not server.is_alive() or time.perf_counter() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def fetch(url: str) -> int:
+    with urllib.request.urlopen(url) as response:
+        return len(response.read())
+
+
+def measure_requests(url: str, clients: int, request_count: int) -> None:
+    fetch(url)  # the first request renders the page
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        sizes = list(executor.map(fetch, [url] * request_count))
+    elapsed = time.perf_counter() - started
+
+    print('requests: {}, clients: {}, bytes: {}'.format(request_count, clients, sum(sizes)))
+    print('elapsed: {:.3f} s'.format(elapsed))
+    print('requests per second: {:.0f}'.format(request_count / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='measures requests per second on a channel page')
+    parser.add_argument('--url', help='base url of a running server. if omitted, a server is started on '
+                                      'a generated data directory')
+    parser.add_argument('--channel', default='channel0', help='id of the requested channel')
+    parser.add_argument('--clients', type=int, default=50, help='number of concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000, help='number of requests')
+    parser.add_argument('--async-mode', default='eventlet', choices=['threading', 'eventlet', 'gevent'],
+                        help='async mode of the started server')
+    parser.add_argument('--workers', type=int, default=1000, help='workers of the started server')
+    parser.add_argument('--port', type=int, default=5123, help='port of the started server')
+    args = parser.parse_args()
+
+    if args.url:
+        measure_requests('{}/{}'.format(args.url.rstrip('/'), args.channel), args.clients, args.requests)
+        sys.exit(0)
+
+    from dataset import generate_data_root
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_root = generate_data_root(Path(temp_dir), item_count=1000, signage_count=10)
+
+        # the server runs in another process not to share the interpreter with the clients
+        server = multiprocessing.get_context('spawn').Process(
+            target=run_server, args=(data_root, args.async_mode, args.port, args.workers), daemon=True)
+        server.start()
+
+        try:
+            channel_url = 'http://127.0.0.1:{}/{}'.format(args.port, args.channel)
+            wait_for_server(channel_url, server)
+            measure_requests(channel_url, args.clients, args.requests)
+        finally:
+            server.terminate()
+            server.join()
@@ -0,0 +1,42 @@
+import argparse
+import gc
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))
+
+from controller.manager import load_managers
+from dataset import generate_data_root
+
+
+def measure_memory(root_path: Path, lazy_values: bool=False) -> None:
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    _, obj_mng, _, sgn_mng, chn_mng = load_managers(root_path, lazy_values=lazy_values)
+
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    object_count = sum(len(obj_mng.get_object_values(x)) for x in obj_mng.object_types.values())
+    scene_count = sum(len(x.scenes) for x in sgn_mng.signages.values())
+
+    print('objects: {}, scenes: {}, channels: {}'.format(object_count, scene_count, len(chn_mng.channels)))
+    print('allocated: {} bytes'.format(allocated))
+    print('per object: {:.0f} bytes'.format(allocated / object_count))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='measures memory allocated to load a generated data directory')
+    parser.add_argument('--items', type=int, default=100000, help='number of generated menu items')
+    parser.add_argument('--signages', type=int, default=100, help='number of generated signages and channels')
+    parser.add_argument('--lazy', action='store_true', help='resolve fields of values on their first access')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_root = generate_data_root(Path(temp_dir), item_count=args.items, signage_count=args.signages)
+        measure_memory(data_root, args.lazy)
@@ -0,0 +1,42 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))
+
+from controller.manager import load_managers
+from dataset import generate_data_root
+from webserver.asset_pipeline import get_resource_urls
+
+
+def measure_page(root_path: Path, repeat: int) -> None:
+    managers = load_managers(root_path)
+    signage = managers.sgn_mng.get_signage('signage0')
+    resource_dir = managers.sgn_mng.root_dir
+
+    # every render starts without a cached page
+    started = time.perf_counter()
+    for _ in range(repeat):
+        signage.invalidate()
+        page = signage.render(resource_dir)
+    elapsed = time.perf_counter() - started
+
+    urls = [x for x in get_resource_urls(page) if x.startswith('/_/')]
+
+    print('scenes: {}'.format(len(signage.scenes)))
+    print('page: {} bytes'.format(len(page.encode('UTF-8'))))
+    print('template resources: {} tags, {} unique'.format(len(urls), len(set(urls))))
+    print('render: {:.2f} ms'.format(elapsed / repeat * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='measures the size and the render time of a signage page')
+    parser.add_argument('--scenes', type=int, default=50, help='number of scenes of the signage')
+    parser.add_argument('--repeat', type=int, default=100, help='number of renders')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_root = generate_data_root(Path(temp_dir), item_count=1000, signage_count=1, scene_count=args.scenes)
+        measure_page(data_root, args.repeat)
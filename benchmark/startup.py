@@ -0,0 +1,60 @@
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'src'))
+
+import utils.persistence
+from controller.manager import ObjectManager, SignageManager, ChannelManager, load_managers
+from dataset import generate_data_root
+
+
+def measure_startup(root_path: Path, use_snapshot: bool=False, lazy_values: bool=False) -> None:
+    started = time.perf_counter()
+
+    managers = load_managers(root_path, use_snapshot, lazy_values)
+
+    elapsed = time.perf_counter() - started
+
+    # pending writes caused by loading are counted too
+    managers.flush()
+    writers = [managers.obj_mng.writer, managers.sgn_mng.writer, managers.chn_mng.writer]
+
+    print('cold start: {:.3f} s'.format(elapsed))
+    print('files written: {}'.format(sum(x.writes for x in writers)))
+    print('bytes written: {}'.format(sum(x.bytes_written for x in writers)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='measures the time to load a generated data directory')
+    parser.add_argument('--items', type=int, default=10000, help='number of generated menu items')
+    parser.add_argument('--signages', type=int, default=100, help='number of generated signages and channels')
+    parser.add_argument('--workers', type=int, default=8, help='number of threads reading files, 1 to read serially')
+    parser.add_argument('--latency', type=float, default=0, help='simulated latency of opening a file in ms, '
+                                                                  'like a network storage')
+    parser.add_argument('--snapshot', action='store_true', help='write snapshots on the first start, '
+                                                                'and measure the second start loading them')
+    parser.add_argument('--lazy', action='store_true', help='resolve fields of values on their first access')
+    args = parser.parse_args()
+
+    for manager_class in [ObjectManager, SignageManager, ChannelManager]:
+        manager_class.load_workers = args.workers
+
+    if args.latency:
+        read_json_file = utils.persistence.read_json_file
+
+        def slow_read_json_file(path: Path) -> dict:
+            time.sleep(args.latency / 1000)
+            return read_json_file(path)
+
+        utils.persistence.read_json_file = slow_read_json_file
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_root = generate_data_root(Path(temp_dir), item_count=args.items, signage_count=args.signages)
+        if args.snapshot:
+            measure_startup(data_root, True, args.lazy)
+            print('--- loading snapshots')
+
+        measure_startup(data_root, args.snapshot, args.lazy)
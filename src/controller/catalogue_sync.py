@@ -0,0 +1,126 @@
+import argparse
+import csv
+import json
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Iterable, Iterator, Set, TextIO
+
+from controller.manager import ObjectManager, BulkSummary, load_managers
+from model.data_type import DataType, ObjectDataType, IntegerDataType, BooleanDataType, ListDataType
+
+# synchronizes values of an object type with a price list exported by another system.
+# run in the src directory: python -m controller.catalogue_sync menu_item prices.csv --delete-missing
+#
+# records are read from a csv file with a header, or a json lines file (.jsonl).
+# every record has an id column and some fields of the type. a list field of a csv file is separated by ';'.
+#
+# a running server or gui holds the values in memory. it doesn't read changed files again, and writes its values over
+# them. while one is running, sync through it, so screens show the changes at once:
+#   python -m controller.catalogue_sync menu_item prices.csv --server http://127.0.0.1:5000
+# without --server, the files of the data directory are changed. do it only while no server or gui is running.
+
+FORMATS = ('csv', 'jsonl')
+
+
+def parse_csv_value(data_type: DataType, text: str):
+    if isinstance(data_type, IntegerDataType):
+        try:
+            return int(text)
+        except ValueError:
+            return text  # reported as an invalid value
+    elif isinstance(data_type, BooleanDataType):
+        return text.strip().lower() in ('true', 'yes', '1')
+    elif isinstance(data_type, ListDataType):
+        return [parse_csv_value(data_type.data_type, x) for x in text.split(';') if x]
+
+    return text
+
+
+def get_format(path: Path) -> str:
+    return 'csv' if path.suffix == '.csv' else 'jsonl'
+
+
+def read_records(stream: TextIO, file_format: str, type_instance: ObjectDataType) -> Iterator[dict]:
+    if file_format == 'csv':
+        schema = type_instance.schema
+
+        for row in csv.DictReader(stream):
+            yield {x: parse_csv_value(schema[x].data_type, y) if x in schema else y for x, y in row.items()}
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def sync(obj_mng: ObjectManager, type_instance: ObjectDataType, records: Iterable[dict], id_key: str='id',
+         delete_missing: bool=False) -> BulkSummary:
+    seen_ids = set()  # type: Set[str]
+
+    def collect_ids(records: Iterator[dict]) -> Iterator[dict]:
+        for record in records:
+            seen_ids.add(record.get(id_key))
+            yield record
+
+    summary = obj_mng.bulk_upsert(type_instance, collect_ids(records), id_key)
+
+    if delete_missing:
+        missing_ids = [x for x in obj_mng.get_object_values(type_instance).keys() if x not in seen_ids]
+        deleted = obj_mng.bulk_delete(type_instance, missing_ids)
+
+        summary.deleted.extend(deleted.deleted)
+        summary.invalid.update(deleted.invalid)
+
+    return summary
+
+
+# sends a file to a running server, which syncs its values. returns the summary.
+def sync_on_server(server_url: str, type_id: str, path: Path, id_key: str='id', delete_missing: bool=False) -> dict:
+    url = '{}/_/sync/{}?{}'.format(server_url.rstrip('/'), type_id, urllib.parse.urlencode({
+        'format': get_format(path), 'id_key': id_key, 'delete_missing': int(delete_missing)}))
+    request = urllib.request.Request(url, data=path.read_bytes(), method='POST',
+                                     headers={'Content-Type': 'text/plain; charset=UTF-8'})
+
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode('UTF-8'))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='adds, updates and deletes values of a type from a csv or '
+                                                 'json lines file')
+    parser.add_argument('type', help='id of the object type, e.g. menu_item')
+    parser.add_argument('file', type=Path, help='a .csv file with a header or a .jsonl file')
+    parser.add_argument('--root', type=Path, default=Path('../data'), help='data directory')
+    parser.add_argument('--id-key', default='id', help='column of value ids')
+    parser.add_argument('--delete-missing', action='store_true', help='delete values which are not in the file')
+    parser.add_argument('--server', help='url of a running server to sync through, e.g. http://127.0.0.1:5000')
+    args = parser.parse_args()
+
+    if args.server:
+        try:
+            summary = sync_on_server(args.server, args.type, args.file, args.id_key, args.delete_missing)
+        except urllib.error.URLError as e:
+            print('failed to sync through {}: {}'.format(args.server, e), file=sys.stderr)
+            return 1
+    else:
+        obj_mng = load_managers(args.root).obj_mng
+        type_instance = obj_mng.get_object_type(args.type)
+
+        with args.file.open(encoding='UTF-8', newline='') as f:
+            summary = sync(obj_mng, type_instance, read_records(f, get_format(args.file), type_instance),
+                           args.id_key, args.delete_missing)._asdict()
+
+    print('added: {}, updated: {}, unchanged: {}, deleted: {}, invalid: {}'.format(
+        len(summary['added']), len(summary['updated']), len(summary['unchanged']), len(summary['deleted']),
+        len(summary['invalid'])))
+
+    for value_id, reason in summary['invalid'].items():
+        print('{}: {}'.format(value_id, reason), file=sys.stderr)
+
+    return 1 if summary['invalid'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
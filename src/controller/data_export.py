@@ -0,0 +1,202 @@
+import argparse
+import base64
+import gzip
+import json
+import sys
+from pathlib import Path
+from typing import Callable, Iterator, Iterable, Dict, TextIO, Tuple, Union
+
+from controller.manager import ObjectManager, TemplateManager, SignageManager, ChannelManager, load_managers
+from utils import utils
+from utils.persistence import write_atomic_files
+
+# exports everything the managers hold to a json lines file, and imports it into another data directory.
+# run in the src directory:
+#   python -m controller.data_export export backup.jsonl.gz --root ../data
+#   python -m controller.data_export import backup.jsonl.gz --root /srv/opdss/data
+#
+# a record is written per line in the order of dependencies: types, values, templates, files of the signage page,
+# signages and channels. the page record holds index.html and libraries in the vendor directory of signages.
+# records are produced and consumed one by one, so neither side holds the whole model at once.
+# media files are not exported. copy the media directory with the file.
+
+EXPORT_VERSION = 1
+
+
+def export_records(obj_mng: ObjectManager, tpl_mng: TemplateManager, sgn_mng: SignageManager,
+                   chn_mng: ChannelManager) -> Iterator[dict]:
+    yield {'kind': 'header', 'version': EXPORT_VERSION}
+
+    object_types = obj_mng.object_types
+    type_ids = ObjectManager.sort_types({x: obj_mng.get_manifest(x) for x in object_types.keys()})
+
+    for type_id in type_ids:
+        yield {'kind': 'type', 'id': type_id, 'data': obj_mng.get_manifest(type_id)}
+
+    for type_id in type_ids:
+        for value_id, value in obj_mng.get_object_values(object_types[type_id]).items():
+            yield {'kind': 'value', 'type': type_id, 'id': value_id, 'data': value.get_values(False, cache=False)}
+
+    for kind, templates in (('scene_template', tpl_mng.scene_templates), ('frame_template', tpl_mng.frame_templates)):
+        for template_id, template in templates.items():
+            yield {'kind': kind, 'id': template_id, 'files': dict(_read_files(template.root_dir))}
+
+    # files of signages are records of their own
+    page_files = dict(_read_files(sgn_mng.root_dir, lambda x: x.suffix != '.json'))
+    for sub_dir in sorted(x for x in sgn_mng.root_dir.iterdir() if x.is_dir()):
+        page_files.update(('{}/{}'.format(sub_dir.name, x), y) for x, y in _read_files(sub_dir))
+
+    yield {'kind': 'page', 'id': 'signage', 'files': page_files}
+
+    for signage_id, signage in sgn_mng.signages.items():
+        yield {'kind': 'signage', 'id': signage_id, 'data': signage.to_dict()}
+
+    for channel_id, channel in chn_mng.channels.items():
+        yield {'kind': 'channel', 'id': channel_id, 'data': channel.to_dict()}
+
+
+def _read_files(directory: Path, include: Callable[[Path], bool]=lambda x: True) -> Iterator[Tuple[str, dict]]:
+    # hidden files, e.g. temporary files of a write, are not exported
+    file_paths = [x for x in directory.iterdir() if x.is_file() and not x.name.startswith('.') and include(x)]
+
+    for file_path in sorted(file_paths):
+        data = file_path.read_bytes()
+
+        try:
+            yield file_path.name, {'text': data.decode('UTF-8')}
+        except UnicodeDecodeError:
+            yield file_path.name, {'base64': base64.b64encode(data).decode('ascii')}
+
+
+def export_jsonl(stream: TextIO, records: Iterable[dict]) -> int:
+    count = 0
+
+    for record in records:
+        stream.write(json.dumps(record))
+        stream.write('\n')
+        count += 1
+
+    return count
+
+
+# returns the paths of the files a record is stored in, and their contents.
+# a record is checked before it is written. an id must not point outside of the directory.
+def get_record_files(root_dir: Path, record: dict) -> Dict[Path, Union[str, bytes]]:
+    kind = record['kind']
+    record_id = record['id']
+    utils.validate_id(record_id)
+
+    if kind == 'type':
+        return {root_dir / 'data' / record_id / 'manifest.json': json.dumps(record['data'])}
+    elif kind == 'value':
+        utils.validate_id(record['type'])
+        return {root_dir / 'data' / record['type'] / (record_id + '.json'): json.dumps(record['data'])}
+    elif kind in ('scene_template', 'frame_template'):
+        return _get_files(root_dir / 'template' / kind.split('_')[0] / record_id, record['files'], 1)
+    elif kind == 'page':
+        if record_id != 'signage':
+            raise AttributeError()
+
+        # a file in a sub directory, e.g. vendor/manifest.json. a json file of the directory would be a signage.
+        files = _get_files(root_dir / 'signage', record['files'], 2)
+        if any(x.parent == root_dir / 'signage' and x.suffix == '.json' for x in files.keys()):
+            raise AttributeError()
+
+        return files
+    elif kind == 'signage':
+        return {root_dir / 'signage' / (record_id + '.json'): json.dumps(record['data'])}
+    elif kind == 'channel':
+        return {root_dir / 'channel' / (record_id + '.json'): json.dumps(record['data'])}
+
+    raise KeyError(kind)
+
+
+# names are relative paths of at most max_depth parts. a part must not be hidden or point to a parent.
+def _get_files(directory: Path, files: Dict[str, dict], max_depth: int) -> Dict[Path, Union[str, bytes]]:
+    contents = dict()
+
+    for file_name, content in files.items():
+        parts = file_name.split('/')
+        if len(parts) > max_depth or any(not x or x.startswith('.') or Path(x).name != x for x in parts):
+            raise AttributeError()
+
+        contents[directory.joinpath(*parts)] = content['text'] if 'text' in content \
+            else base64.b64decode(content['base64'])
+
+    return contents
+
+
+# writes records to the files of a data directory. existing files of the same ids are replaced.
+# files are written in chunks not to keep every record in memory.
+# returns the number of records of each kind.
+def import_jsonl(stream: TextIO, root_dir: Path, chunk_size: int=1000) -> Dict[str, int]:
+    counts = dict()
+    pending = dict()
+
+    def write_pending():
+        for parent in set(x.parent for x in pending.keys()):
+            parent.mkdir(parents=True, exist_ok=True)
+
+        errors = write_atomic_files(pending)[2]
+        if errors:
+            raise next(iter(errors.values()))
+
+        pending.clear()
+
+    for sub_dir in ('data', 'template/scene', 'template/frame', 'signage', 'channel', 'media/image', 'media/video'):
+        (root_dir / sub_dir).mkdir(parents=True, exist_ok=True)
+
+    header = json.loads(stream.readline() or '{}')
+    if header.get('kind') != 'header' or header.get('version') != EXPORT_VERSION:
+        raise ValueError('not an export of version {}'.format(EXPORT_VERSION))
+
+    for line in stream:
+        if not line.strip():
+            continue
+
+        record = json.loads(line)
+        pending.update(get_record_files(root_dir, record))
+        counts[record['kind']] = counts.get(record['kind'], 0) + 1
+
+        if len(pending) >= chunk_size:
+            write_pending()
+
+    write_pending()
+
+    return counts
+
+
+def open_text(path: Path, mode: str) -> TextIO:
+    if path.suffix == '.gz':
+        return gzip.open(str(path), mode + 't', encoding='UTF-8')
+
+    return path.open(mode, encoding='UTF-8')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='exports types, values, templates, signages and channels to a json '
+                                                 'lines file, or imports them from it')
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('file', type=Path, help='a .jsonl file. compressed if it ends with .gz')
+    parser.add_argument('--root', type=Path, default=Path('../data'), help='data directory')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        managers = load_managers(args.root, lazy_values=True)
+
+        with open_text(args.file, 'w') as f:
+            count = export_jsonl(f, export_records(managers.obj_mng, managers.tpl_mng, managers.sgn_mng,
+                                                   managers.chn_mng))
+
+        print('exported: {}'.format(count - 1))
+    else:
+        with open_text(args.file, 'r') as f:
+            counts = import_jsonl(f, args.root)
+
+        print(', '.join('{}: {}'.format(x, y) for x, y in counts.items()))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+from collections import deque
+from typing import Any, Callable, Dict, Iterable, List, Set
+
+
+class DependencyGraph:
+    # directed graph between object values, signages and channels.
+    # an edge (node -> dependency) means that node embeds the dependency, i.e. a signage depends on its scene values.
+    # reverse edges are kept together so that dependents of a node can be found without a full scan.
+    def __init__(self):
+        self._dependencies = dict()  # type: Dict[Any, Set[Any]]
+        self._dependents = dict()  # type: Dict[Any, Set[Any]]
+        self._invalidation_handlers = dict()  # type: Dict[Any, Callable[[Any], None]]
+
+    def set_dependencies(self, node, dependencies: Iterable) -> None:
+        new_dependencies = {x for x in dependencies if x is not None}
+        old_dependencies = self._dependencies.get(node, frozenset())
+
+        for removed in old_dependencies - new_dependencies:
+            dependents = self._dependents[removed]
+            dependents.discard(node)
+            if not dependents:
+                del self._dependents[removed]
+
+        for added in new_dependencies - old_dependencies:
+            self._dependents.setdefault(added, set()).add(node)
+
+        # most values embed nothing. don't keep an empty set for each of them.
+        if new_dependencies:
+            self._dependencies[node] = new_dependencies
+        else:
+            self._dependencies.pop(node, None)
+
+    def get_dependencies(self, node) -> Set[Any]:
+        return set(self._dependencies.get(node, ()))
+
+    def get_dependents(self, node, recursive: bool=False) -> Set[Any]:
+        if not recursive:
+            return set(self._dependents.get(node, ()))
+
+        return set(self._walk_dependents([node]))
+
+    def remove_node(self, node) -> None:
+        self.set_dependencies(node, ())
+        self._invalidation_handlers.pop(node, None)
+
+    # handler is called with the node. share a function between nodes rather than binding one for each.
+    def set_invalidation_handler(self, node, handler: Callable[[Any], None]) -> None:
+        self._invalidation_handlers[node] = handler
+
+    # calls the invalidation handler of every node which depends on the given nodes directly or indirectly.
+    # each handler is called once, in breadth-first order from the given nodes.
+    def invalidate(self, nodes: Iterable) -> None:
+        for dependent in self._walk_dependents(nodes):
+            handler = self._invalidation_handlers.get(dependent)
+            if handler is not None:
+                handler(dependent)
+
+    def _walk_dependents(self, nodes: Iterable) -> List[Any]:
+        visited = set()
+        ordered = []
+        queue = deque(nodes)
+
+        while queue:
+            for dependent in self._dependents.get(queue.popleft(), ()):
+                if dependent in visited:
+                    continue
+
+                visited.add(dependent)
+                ordered.append(dependent)
+                queue.append(dependent)
+
+        return ordered
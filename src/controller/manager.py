@@ -1,17 +1,22 @@
+import contextlib
 import copy
 import json
 import os
 import shutil
 from collections import deque
 from datetime import time
+from itertools import islice
 from pathlib import Path
-from typing import Optional, Dict, Callable
+from typing import Optional, Dict, Callable, List, Set, NamedTuple, Iterable, Iterator
 
 import utils.logger
-from model.data_type import ObjectDataType, ListDataType, STR_TO_PRIMITIVE_TYPE, DataType, FileDataType
+from controller.dependency_graph import DependencyGraph
+from model.data_type import ObjectDataType, ListDataType, STR_TO_PRIMITIVE_TYPE, DataType, FileDataType, FieldKind
 from model.data_value import ObjectValue, FileValue
 from model.signage import Signage, Scene, TransitionType, Frame, Schedule, ScheduleType
-from model.template import SceneTemplate, FrameTemplate
+from model.template import Template, SceneTemplate, FrameTemplate
+from utils.persistence import WriteBehindWriter, read_json_files, read_snapshot, write_snapshot, \
+    get_directory_fingerprint
 
 
 class MultimediaManager:
@@ -46,39 +51,39 @@ class MultimediaManager:
             shutil.copy2(str(new_file_path), str(self._image_type.root_dir))
 
         new_image = FileValue(self._image_type, new_file_path.name)
-
-        def id_change_handler(old_name: str, new_name: str):
-            os.rename(str(self._image_type.root_dir / old_name), str(self._image_type.root_dir / new_name))
-            del self._images[old_name]
-            self._images[new_name] = new_image
-
-            refs = self._sgn_mng.get_value_references(new_image)
-            refs.update(self._obj_mng.get_value_references(new_image))
-
-            for ref in refs.values():
-                ref.on_value_change()
-
-        new_image.on_id_change = id_change_handler
+        new_image.on_id_change = self._handle_image_rename
         self._images[new_image.file_name] = new_image
 
     def add_video(self, new_file_path: Path):
         if not new_file_path.parent.resolve().samefile(self._video_type.root_dir.resolve()):
             shutil.copy2(str(new_file_path), str(self._video_type.root_dir))
-        new_video = FileValue(self._image_type, new_file_path.name)
+        new_video = FileValue(self._video_type, new_file_path.name)
+        new_video.on_id_change = self._handle_video_rename
+        self._videos[new_video.file_name] = new_video
 
-        def id_change_handler(old_name: str, new_name: str):
-            os.rename(str(self._video_type.root_dir / old_name), str(self._video_type.root_dir / new_name))
-            del self._videos[old_name]
-            self._videos[new_name] = new_video
+    def _handle_image_rename(self, image: FileValue, old_name: str, new_name: str) -> None:
+        os.rename(str(self._image_type.root_dir / old_name), str(self._image_type.root_dir / new_name))
+        del self._images[old_name]
+        self._images[new_name] = image
 
-            refs = self._sgn_mng.get_value_references(new_video)
-            refs.update(self._obj_mng.get_value_references(new_video))
+        self._notify_file_rename(image)
 
-            for ref in refs.values():
-                ref.on_value_change()
+    def _handle_video_rename(self, video: FileValue, old_name: str, new_name: str) -> None:
+        os.rename(str(self._video_type.root_dir / old_name), str(self._video_type.root_dir / new_name))
+        del self._videos[old_name]
+        self._videos[new_name] = video
 
-        new_video.on_id_change = id_change_handler
-        self._videos[new_video.file_name] = new_video
+        self._notify_file_rename(video)
+
+    def _notify_file_rename(self, file: FileValue) -> None:
+        # values embedding this file cache its old name
+        self._obj_mng.dependency_graph.invalidate([file])
+
+        refs = self._sgn_mng.get_value_references(file)
+        refs.update(self._obj_mng.get_value_references(file))
+
+        for ref in refs.values():
+            ref.on_value_change(ref)
 
     @property
     def root_path(self) -> Path:
@@ -97,10 +102,17 @@ class MultimediaManager:
         return copy.copy(self._images)
 
     def get_image(self, file_id: str) -> FileValue:
-        return self.images[file_id] if file_id else None
+        return self._images[file_id] if file_id else None
 
     def get_video(self, file_id: str) -> FileValue:
-        return self.videos[file_id] if file_id else None
+        return self._videos[file_id] if file_id else None
+
+    # value of a file field. file_type is the image type or the video type.
+    def get_file(self, file_type: FileDataType, file_id: str) -> Optional[FileValue]:
+        if file_type is self._video_type:
+            return self.get_video(file_id)
+
+        return self.get_image(file_id)
 
     @property
     def videos(self) -> Dict[str, FileValue]:
@@ -114,6 +126,7 @@ class MultimediaManager:
             raise ReferenceError(refs)
 
         del self._images[to_delete.file_name]
+        self._obj_mng.dependency_graph.remove_node(to_delete)
         os.remove(str(to_delete.file_path))
 
     def remove_video(self, to_delete: FileValue):
@@ -123,12 +136,25 @@ class MultimediaManager:
         if refs:
             raise ReferenceError(refs)
 
-        del self.videos[to_delete.file_name]
+        del self._videos[to_delete.file_name]
+        self._obj_mng.dependency_graph.remove_node(to_delete)
         os.remove(str(to_delete.file_path))
 
 
+class BulkSummary(NamedTuple):
+    added: List[str]
+    updated: List[str]
+    unchanged: List[str]
+    deleted: List[str]
+    invalid: Dict[str, str]  # id (or #position of a record without an id) -> reason
+
+
 class ObjectManager:
-    def __init__(self, root_dir: Path, mtm_mng: MultimediaManager):
+    load_workers = 8  # number of threads reading value files on loading
+    bulk_size = 1000  # number of records validated together in bulk_upsert
+
+    def __init__(self, root_dir: Path, mtm_mng: MultimediaManager, use_snapshot: bool=False,
+                 lazy_values: bool=False):
         self._root_dir = root_dir
         self._mtm_mng = mtm_mng
         self._tpl_mng = None
@@ -136,6 +162,24 @@ class ObjectManager:
 
         self._object_types = dict()
         self._object_values = dict()
+        self._manifests = dict()
+
+        # if true, all types and values are loaded from a single snapshot file while the directory is not changed
+        self._use_snapshot = use_snapshot
+        self._snapshot_fingerprint = None
+
+        # if true, fields of loaded values are converted and validated when they are accessed first
+        self._lazy_values = lazy_values
+
+        # handlers shared by all managed values. methods are bound once, not for every value.
+        self._value_id_change_handler = self._handle_value_id_change
+        self._value_change_handler = self._handle_value_change
+
+        # shared with the signage and channel manager to track which signages embed which values
+        self._dependency_graph = DependencyGraph()
+        self._writer = WriteBehindWriter()
+        self._loading = False  # if true, loaded entities are not saved and change notifications are suppressed
+        self._bulk_values = None  # values changed in bulk_changes. they are saved and notified at the end.
 
         self.load_all()
 
@@ -147,6 +191,38 @@ class ObjectManager:
     def root_dir(self) -> Path:
         return self._root_dir
 
+    @property
+    def dependency_graph(self) -> DependencyGraph:
+        return self._dependency_graph
+
+    @property
+    def writer(self) -> WriteBehindWriter:
+        return self._writer
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self._root_dir.with_name(self._root_dir.name + '.snapshot')
+
+    # writes pending changes to files immediately. call this before the program ends.
+    def flush(self) -> None:
+        self._writer.flush()
+
+        if self._use_snapshot and get_directory_fingerprint(self._root_dir, True) != self._snapshot_fingerprint:
+            self.save_snapshot()
+
+    def save_snapshot(self) -> None:
+        fingerprint = get_directory_fingerprint(self._root_dir, True)
+        entities = dict()
+
+        for type_id, type_instance in self._object_types.items():
+            entities['manifest/{}'.format(type_id)] = self._manifests[type_id]
+
+            for value_id, value in self._object_values[type_instance].items():
+                entities['value/{}/{}'.format(type_id, value_id)] = value.get_values(False)
+
+        write_snapshot(self.snapshot_path, fingerprint, entities)
+        self._snapshot_fingerprint = fingerprint
+
     @property
     def object_types(self) -> Dict[str, ObjectDataType]:
         return copy.copy(self._object_types)
@@ -154,58 +230,148 @@ class ObjectManager:
     def get_object_type(self, type_id: str) -> ObjectDataType:
         return self._object_types[type_id]
 
+    # the manifest a type is loaded from
+    def get_manifest(self, type_id: str) -> dict:
+        return copy.deepcopy(self._manifests[type_id])
+
     def get_object_value(self, type_instance: ObjectDataType, value_id: str) -> ObjectValue:
         return self._object_values[type_instance][value_id] if value_id else None
 
     def get_object_values(self, type_instance: ObjectDataType) -> Dict[str, ObjectValue]:
         return copy.copy(self._object_values[type_instance])
 
+    # values of frames and scenes have no id. they are handled by the signage manager.
     def get_value_references(self, to_check) -> Dict[str, ObjectValue]:
-        return {'object/{}.{}'.format(type_value.id, value_id): value
-                for type_value, values_dict in self._object_values.items()
-                for value_id, value in filter(lambda x: x[1].has_references(to_check), values_dict.items())}
+        return {'object/{}.{}'.format(value.data_type.id, value.id): value
+                for value in self._dependency_graph.get_dependents(to_check)
+                if isinstance(value, ObjectValue) and value.id is not None}
 
     def get_type_references(self, to_check) -> Dict[str, ObjectDataType]:
-        return {'type/{}'.format(type_id): type_value
-                for type_id, type_value in filter(lambda x: x[1].has_references(to_check), self._object_types.items())}
+        return {'type/{}'.format(type_value.id): type_value
+                for type_value in self._dependency_graph.get_dependents(to_check)
+                if isinstance(type_value, ObjectDataType)}
 
     def load_all(self) -> None:
+        self._loading = True
+        try:
+            self._load_files()
+        finally:
+            self._loading = False
+
+    def _load_files(self) -> None:
         self._object_types = dict()
         self._object_values = dict()
 
-        types_dir = [x for x in self._root_dir.iterdir() if x.is_dir()]
-        # todo: currently, a method to handle dependency problem is awful.
-        # -> if a dependency problem occurs, just postpone that type.
-        # in worst case, infinite loop could be occurred!
-        type_queue = deque([(x.name, x) for x in types_dir])
-        while type_queue:
-            current_type = type_queue.popleft()
-            type_id, type_dir = current_type
+        fingerprint = get_directory_fingerprint(self._root_dir, True) if self._use_snapshot else None
+        snapshot = read_snapshot(self.snapshot_path, fingerprint) if self._use_snapshot else None
+
+        if snapshot is not None:
+            manifests = {x.split('/')[1]: snapshot[x] for x in snapshot.keys() if x.startswith('manifest/')}
+            type_ids = self.sort_types(manifests)
+
+            value_ids = {type_id: [] for type_id in manifests.keys()}
+            for type_id, value_id in [x.split('/')[1:] for x in snapshot.keys() if x.startswith('value/')]:
+                value_ids[type_id].append(value_id)
+
+            value_contents = (snapshot['value/{}/{}'.format(type_id, value_id)]
+                              for type_id in type_ids for value_id in value_ids[type_id])
+        else:
+            # read every manifest once, and load types after the types they depend on
+            manifests = dict()
+            for type_dir in [x for x in self._root_dir.iterdir() if x.is_dir()]:
+                with (type_dir / 'manifest.json').open(encoding='UTF-8') as f:
+                    manifests[type_dir.name] = json.load(f)
 
-            # initialize new object type
-            with (type_dir / 'manifest.json').open(encoding='UTF-8') as f:
-                mnf_contents = json.load(f)
-                new_type = self.load_object_type(type_id, mnf_contents)
+            type_ids = self.sort_types(manifests)
+            value_paths = {type_id: [x for x in (self._root_dir / type_id).glob('*.json') if x.stem != 'manifest']
+                           for type_id in type_ids}
+            value_ids = {type_id: [x.stem for x in paths] for type_id, paths in value_paths.items()}
+
+            # value files of all types are read concurrently, but objects are built in the order of types.
+            value_contents = read_json_files([x for type_id in type_ids for x in value_paths[type_id]],
+                                             self.load_workers)
+
+        self._manifests = manifests
+
+        for type_id in type_ids:
+            new_type = self.load_object_type(type_id, manifests[type_id])
 
             if not new_type:
-                type_queue.append(current_type)
+                utils.logger.error('{} has an invalid field type'.format(type_id))
+
+                for _ in value_ids[type_id]:
+                    next(value_contents)  # skip values of the type
                 continue
 
             self._object_types[type_id] = new_type
+            self._dependency_graph.set_dependencies(new_type, self.get_referenced_object_types(new_type))
 
             # loads object values
             self._object_values[new_type] = dict()
 
-            for value_id, value_path in [(x.stem, x) for x in type_dir.glob('*.json')]:
-                if value_id == 'manifest':
-                    continue
+            for value_id, value_content in zip(value_ids[type_id], value_contents):
+                new_object = self.load_object_value(value_id, new_type, value_content)
+                self.add_object_value(new_object)
 
-                with value_path.open(encoding='UTF-8') as f:
-                    new_object = self.load_object_value(value_id, new_type, json.load(f))
+            utils.logger.info('{} loaded from a {}'.format(new_type.name, 'snapshot' if snapshot else 'file'))
 
-                self.add_object_value(new_object)
+        if snapshot is not None:
+            self._snapshot_fingerprint = fingerprint
+        elif self._use_snapshot:
+            self.save_snapshot()
+
+    @staticmethod
+    def get_type_dependencies(manifest: dict) -> Set[str]:
+        dependencies = set()
+
+        for field_value in manifest.get('fields', {}).values():
+            target_type = field_value[2]['type']
+
+            # strip list prefixes like '[0,20]'
+            while target_type.startswith('['):
+                target_type = target_type[target_type.find(']') + 1:]
+
+            if target_type.startswith('$'):
+                dependencies.add(target_type[1:])
+
+        return dependencies
 
-            utils.logger.info('{} loaded from a file'.format(new_type.name))
+    # returns type ids in topological order of their dependencies.
+    # types depending on missing types or in a dependency cycle are excluded and reported as errors.
+    @classmethod
+    def sort_types(cls, manifests: Dict[str, dict]) -> List[str]:
+        dependencies = {type_id: cls.get_type_dependencies(manifest) for type_id, manifest in manifests.items()}
+        dependents = {type_id: [] for type_id in manifests.keys()}
+        remaining = dict()
+
+        for type_id, type_dependencies in dependencies.items():
+            missing = type_dependencies - manifests.keys()
+            if missing:
+                utils.logger.error('{} depends on unknown types: {}'.format(type_id, ', '.join(sorted(missing))))
+
+            # a missing dependency is never resolved, so the type is never loaded
+            remaining[type_id] = len(type_dependencies)
+
+            for dependency in type_dependencies - missing:
+                dependents[dependency].append(type_id)
+
+        type_queue = deque(sorted(x for x, count in remaining.items() if count == 0))
+        ordered = []
+
+        while type_queue:
+            type_id = type_queue.popleft()
+            ordered.append(type_id)
+
+            for dependent in dependents[type_id]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    type_queue.append(dependent)
+
+        not_loaded = sorted(manifests.keys() - set(ordered))
+        if not_loaded:
+            utils.logger.error('types not loaded due to cyclic or missing dependencies: {}'.format(', '.join(not_loaded)))
+
+        return ordered
 
     def load_object_type(self, type_id: str, data: dict) -> ObjectDataType:
         # populate raw fields values to real python objects
@@ -217,12 +383,16 @@ class ObjectManager:
                 except KeyError:
                     return None
 
-            data['fields'] = fields
+            data = dict(data, fields=fields)  # keep the raw manifest unchanged
 
         new_type = ObjectDataType(type_id=type_id, **data)
 
         return new_type
 
+    @staticmethod
+    def get_referenced_object_types(type_instance: ObjectDataType) -> List[ObjectDataType]:
+        return [x for x in type_instance.referenced_types if isinstance(x, ObjectDataType)]
+
     def dict_to_type(self, json_data: dict) -> DataType:
         target_type = json_data['type']
         type_params = copy.deepcopy(json_data)
@@ -249,33 +419,196 @@ class ObjectManager:
         return type_instance
 
     def load_object_value(self, object_id: Optional[str], data_type: ObjectDataType, data: dict) -> ObjectValue:
-        new_object = ObjectValue(object_id, data_type, self, self._mtm_mng)
-
-        for field_id, field_value in data.items():
-            new_object.set_value(field_id, field_value)
+        if self._lazy_values:
+            new_object = ObjectValue(object_id, data_type, self, self._mtm_mng, lazy=True)
+            new_object.load_values(**data)
+        else:
+            new_object = ObjectValue(object_id, data_type, self, self._mtm_mng)
+            new_object.set_values(**data)
 
         return new_object
 
     def add_object_value(self, new_object: ObjectValue) -> None:
-        object_dir = self._root_dir / new_object.data_type.id
+        new_object.on_id_change = self._value_id_change_handler
+        new_object.on_value_change = self._value_change_handler
+        self._dependency_graph.set_invalidation_handler(new_object, ObjectValue.invalidate)
 
-        def id_change_handler(old_id, new_id):
-            del self._object_values[new_object.data_type][old_id]
-            self._object_values[new_object.data_type][new_id] = new_object
+        self._object_values[new_object.data_type][new_object.id] = new_object
 
-            os.remove(str(object_dir / (old_id + '.json')))
-            # todo: find references and update them. it should be hard work! :weary:
+        if self._loading:
+            # just read from a file. don't write it back.
+            self._dependency_graph.set_dependencies(new_object, new_object.get_references())
+        else:
+            self._handle_value_change(new_object)  # save to file
+
+    def _handle_value_id_change(self, value: ObjectValue, old_id: str, new_id: str) -> None:
+        del self._object_values[value.data_type][old_id]
+        self._object_values[value.data_type][new_id] = value
+
+        self._writer.delete(self._root_dir / value.data_type.id / (old_id + '.json'))
+        self._dependency_graph.invalidate([value])
+
+        # referencing values are saved with an id of this value. save them again with the new id.
+        refs = self.get_value_references(value)
+        refs.update(self._sgn_mng.get_value_references(value))
+
+        for ref in refs.values():
+            ref.on_value_change(ref)
+
+    def _handle_value_change(self, value: ObjectValue) -> None:
+        if self._bulk_values is not None:
+            self._bulk_values.add(value)
+            return
+
+        self._save_value(value)
+        self._dependency_graph.invalidate([value])  # signages and channels showing this value
+
+    def _save_value(self, value: ObjectValue) -> None:
+        value_path = self._root_dir / value.data_type.id / (value.id + '.json')
+        self._writer.schedule(value_path, json.dumps(value.get_values(False)))
+
+        self._dependency_graph.set_dependencies(value, value.get_references())
+
+    # values changed in this block are saved in one pass and notified once, when the block ends
+    @contextlib.contextmanager
+    def bulk_changes(self) -> Iterator[None]:
+        if self._bulk_values is not None:
+            yield  # already in a bulk change
+            return
+
+        self._bulk_values = set()
+        try:
+            yield
+        finally:
+            values, self._bulk_values = self._bulk_values, None
+            values = [x for x in values if self._object_values.get(x.data_type, {}).get(x.id) is x]  # not removed
+
+            for value in values:
+                self._save_value(value)
+
+            self._dependency_graph.invalidate(values)
+            self.flush()
+
+    # adds or updates values of a type. each record is a dict of an id and field values.
+    # a record with only some fields changes only those fields of an existing value.
+    # invalid records are skipped and reported in the summary. the others are applied.
+    def bulk_upsert(self, type_instance: ObjectDataType, records: Iterable[dict], id_key: str='id') -> BulkSummary:
+        summary = BulkSummary([], [], [], [], {})
+        records = iter(records)
+        position = 0
+
+        with self.bulk_changes():
+            while True:
+                chunk = list(islice(records, self.bulk_size))
+                if not chunk:
+                    break
+
+                self._upsert_chunk(type_instance, chunk, position, id_key, summary)
+                position += len(chunk)
+
+        return summary
+
+    def _upsert_chunk(self, type_instance: ObjectDataType, chunk: List[dict], position: int, id_key: str,
+                      summary: BulkSummary) -> None:
+        schema = type_instance.schema
+        invalid = dict()  # index in the chunk -> reason
+
+        for index, record in enumerate(chunk):
+            unknown_keys = [x for x in record.keys() if x != id_key and x not in schema]
+
+            if id_key not in record:
+                invalid[index] = 'no {}'.format(id_key)
+            elif unknown_keys:
+                invalid[index] = 'unknown fields {}'.format(', '.join(unknown_keys))
+
+        # primitive fields are validated together for each field
+        for key, field in schema.items():
+            if field.kind is not FieldKind.PRIMITIVE:
+                continue
 
-        def value_change_handler():
-            with (object_dir / (new_object.id + '.json')).open('w') as f:
-                f.write(json.dumps(new_object.get_values(False)))
+            indexes = [index for index, record in enumerate(chunk) if key in record and index not in invalid]
+            for invalid_index in self._validate_batch(field.data_type, [chunk[x][key] for x in indexes]):
+                invalid[indexes[invalid_index]] = 'invalid {}'.format(key)
 
-        new_object.on_id_change = id_change_handler
-        new_object.on_value_change = value_change_handler
+        for index, record in enumerate(chunk):
+            value_id = record.get(id_key)
+            name = value_id if isinstance(value_id, str) else '#{}'.format(position + index)
 
-        self._object_values[new_object.data_type][new_object.id] = new_object
+            if index in invalid:
+                summary.invalid[name] = invalid[index]
+                continue
 
-        value_change_handler()  # save to file
+            fields = {x: y for x, y in record.items() if x != id_key}
+
+            try:
+                self._validate_fields(type_instance, fields)
+
+                value = self._object_values[type_instance].get(value_id)
+                if value is None:
+                    self.add_object_value(self.load_object_value(value_id, type_instance, fields))
+                    summary.added.append(value_id)
+                    continue
+
+                current = value.get_values(False)
+                changed = {x: y for x, y in fields.items() if current.get(x) != y}
+
+                if changed:
+                    value.set_values(**changed)
+                    summary.updated.append(value_id)
+                else:
+                    summary.unchanged.append(value_id)
+            except (AttributeError, KeyError, TypeError, ValueError) as e:
+                summary.invalid[name] = 'invalid value {}'.format(repr(e))
+
+    @staticmethod
+    def _validate_batch(data_type: DataType, values: list) -> List[int]:
+        try:
+            return data_type.validate_batch(values)
+        except (TypeError, ValueError):
+            pass
+
+        # some values are of a wrong type. find them one by one.
+        invalid = []
+        for index, value in enumerate(values):
+            try:
+                if not data_type.is_valid(value):
+                    invalid.append(index)
+            except (TypeError, ValueError):
+                invalid.append(index)
+
+        return invalid
+
+    def _validate_fields(self, type_instance: ObjectDataType, fields: dict) -> None:
+        # converts dates and references on a detached value. it raises before an existing value is changed.
+        converted = [x for x in fields.keys() if type_instance.schema[x].kind is not FieldKind.PRIMITIVE]
+        if not converted:
+            return
+
+        staged = ObjectValue(None, type_instance, self, self._mtm_mng, lazy=True)
+        staged.load_values(**{x: fields[x] for x in converted})
+
+        for key in converted:
+            staged.get_value(key)
+
+    # removes values of a type. values which don't exist or are referenced are reported in the summary.
+    def bulk_delete(self, type_instance: ObjectDataType, value_ids: Iterable[str]) -> BulkSummary:
+        summary = BulkSummary([], [], [], [], {})
+
+        with self.bulk_changes():
+            for value_id in value_ids:
+                value = self._object_values[type_instance].get(value_id)
+
+                if value is None:
+                    summary.invalid[value_id] = 'not found'
+                    continue
+
+                try:
+                    self.remove_object_value(value)
+                    summary.deleted.append(value_id)
+                except ReferenceError as e:
+                    summary.invalid[value_id] = 'referenced by {}'.format(', '.join(sorted(e.args[0].keys())))
+
+        return summary
 
     def remove_object_type(self, to_delete: ObjectDataType):
         references = self.get_type_references(to_delete)
@@ -284,10 +617,16 @@ class ObjectManager:
         if references:
             raise ReferenceError(references)
 
+        for value in self._object_values[to_delete].values():
+            self._writer.delete(self._root_dir / to_delete.id / (value.id + '.json'))
+            self._dependency_graph.remove_node(value)
+
         delete_dir = Path(self._root_dir / to_delete.id)
         shutil.rmtree(str(delete_dir))
 
         del self._object_types[to_delete.id]
+        del self._object_values[to_delete]
+        self._dependency_graph.remove_node(to_delete)
 
     def remove_object_value(self, to_delete: ObjectValue):
         refs = self.get_value_references(to_delete)
@@ -297,7 +636,10 @@ class ObjectManager:
             raise ReferenceError(refs)
 
         delete_path = Path(self._root_dir / to_delete.data_type.id / (to_delete.id + '.json'))
-        os.remove(str(delete_path))
+        self._writer.delete(delete_path)
+
+        del self._object_values[to_delete.data_type][to_delete.id]
+        self._dependency_graph.remove_node(to_delete)
 
 
 class TemplateManager:
@@ -307,6 +649,7 @@ class TemplateManager:
         self._sgn_mng = None
         self._scene_templates = dict()
         self._frame_templates = dict()
+        self._dependency_graph = obj_mng.dependency_graph
         self.load_all()
 
     def bind_managers(self, sgn_mng: 'SignageManager'):
@@ -344,6 +687,8 @@ class TemplateManager:
                                                                     self._obj_mng.load_object_type('', json.load(f)),
                                                                     scene_dir)
 
+            self._register_template(self._scene_templates[scene_tpl_id])
+
         utils.logger.info('{} loaded from a file'.format(self._scene_templates[scene_tpl_id].definition.name))
 
         # load frames
@@ -358,14 +703,19 @@ class TemplateManager:
 
                 utils.logger.info('{} loaded from a file'.format(self._frame_templates[frame_tpl_id].definition.name))
 
+            self._register_template(self._frame_templates[frame_tpl_id])
+
+    def _register_template(self, template: Template) -> None:
+        self._dependency_graph.set_dependencies(template, self._obj_mng.get_referenced_object_types(template.definition))
+
     def get_type_references(self, to_check) -> Dict[str, ObjectDataType]:
-        frame_refs = {'frame/{}'.format(frame_id): frame_ins
-                      for frame_id, frame_ins
-                      in filter(lambda x: x[1].definition.has_references(to_check), self._frame_templates.items())}
+        frame_refs = {'frame/{}'.format(frame_ins.id): frame_ins
+                      for frame_ins in self._dependency_graph.get_dependents(to_check)
+                      if isinstance(frame_ins, FrameTemplate)}
 
-        scene_refs = {'scene/{}'.format(scene_id): scene_ins
-                      for scene_id, scene_ins
-                      in filter(lambda x: x[1].definition.has_references(to_check), self._scene_templates.items())}
+        scene_refs = {'scene/{}'.format(scene_ins.id): scene_ins
+                      for scene_ins in self._dependency_graph.get_dependents(to_check)
+                      if isinstance(scene_ins, SceneTemplate)}
 
         frame_refs.update(scene_refs)
 
@@ -380,6 +730,9 @@ class TemplateManager:
         delete_path = Path(self._root_dir / 'scene' / to_delete.id)
         shutil.rmtree(str(delete_path))
 
+        del self._scene_templates[to_delete.id]
+        self._dependency_graph.remove_node(to_delete)
+
     def remove_frame_template(self, to_delete: FrameTemplate):
         refs = self._sgn_mng.get_frame_template_references(to_delete)
 
@@ -389,14 +742,25 @@ class TemplateManager:
         delete_path = Path(self._root_dir / 'frame' / to_delete.id)
         shutil.rmtree(str(delete_path))
 
+        del self._frame_templates[to_delete.id]
+        self._dependency_graph.remove_node(to_delete)
+
 
 class SignageManager:
-    def __init__(self, root_dir: Path, obj_mng: ObjectManager, tpl_mng: TemplateManager):
+    load_workers = 8
+
+    def __init__(self, root_dir: Path, obj_mng: ObjectManager, tpl_mng: TemplateManager, use_snapshot: bool=False):
         self._tpl_mng = tpl_mng
         self._obj_mng = obj_mng
         self._chn_mng = None
         self._root_dir = root_dir
         self._signages = dict()
+        self._dependency_graph = obj_mng.dependency_graph
+        self._writer = WriteBehindWriter()
+        self._loading = False
+        self._use_snapshot = use_snapshot
+        self._snapshot_fingerprint = None
+        self._change_event_handler = lambda signage: None  # called when a signage is changed or removed
         self.load_all()
 
     def bind_managers(self, chn_mng: 'ChannelManager'):
@@ -406,6 +770,37 @@ class SignageManager:
     def root_dir(self) -> Path:
         return self._root_dir
 
+    @property
+    def dependency_graph(self) -> DependencyGraph:
+        return self._dependency_graph
+
+    @property
+    def writer(self) -> WriteBehindWriter:
+        return self._writer
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self._root_dir.with_name(self._root_dir.name + '.snapshot')
+
+    def flush(self) -> None:
+        self._writer.flush()
+
+        if self._use_snapshot and get_directory_fingerprint(self._root_dir) != self._snapshot_fingerprint:
+            self.save_snapshot()
+
+    def save_snapshot(self) -> None:
+        fingerprint = get_directory_fingerprint(self._root_dir)
+        write_snapshot(self.snapshot_path, fingerprint, {x: y.to_dict() for x, y in self._signages.items()})
+        self._snapshot_fingerprint = fingerprint
+
+    @property
+    def change_event_handler(self) -> Callable[[Signage], None]:
+        return self._change_event_handler
+
+    @change_event_handler.setter
+    def change_event_handler(self, new_handler: Callable[[Signage], None]) -> None:
+        self._change_event_handler = new_handler
+
     @property
     def signages(self) -> Dict[str, Signage]:
         return copy.copy(self._signages)
@@ -414,14 +809,26 @@ class SignageManager:
         return self._signages[key]
 
     def load_all(self) -> None:
+        self._loading = True
+        try:
+            self._load_files()
+        finally:
+            self._loading = False
+
+    def _load_files(self) -> None:
         self._signages = dict()
 
-        for signage_id, signage_mnf in [(x.stem, x) for x in self._root_dir.glob('*.json')]:
+        fingerprint = get_directory_fingerprint(self._root_dir) if self._use_snapshot else None
+        snapshot = read_snapshot(self.snapshot_path, fingerprint) if self._use_snapshot else None
 
-            # load from the signage file
-            with signage_mnf.open(encoding='UTF-8') as f:
-                dct = json.load(f)
+        if snapshot is not None:
+            signage_contents = ((x, snapshot[x]) for x in snapshot.keys())
+        else:
+            # files are read concurrently, and signages are built on this thread
+            signage_files = list(self._root_dir.glob('*.json'))
+            signage_contents = zip([x.stem for x in signage_files], read_json_files(signage_files, self.load_workers))
 
+        for signage_id, dct in signage_contents:
             # load scenes
             scenes = []
             for scene_value in dct['scenes']:
@@ -438,7 +845,7 @@ class SignageManager:
                     scene_schedule.to_time = time(*[int(x) for x in schedule_value['to'].split(':')])
 
                 if 'day_of_week' in schedule_value.keys():
-                    scene_schedule.date_of_week = schedule_value['day_of_week']
+                    scene_schedule.day_of_week = schedule_value['day_of_week']
 
                 scenes.append(Scene(scene_template,
                                     scene_data,
@@ -456,7 +863,12 @@ class SignageManager:
             new_signage = Signage(signage_id, dct['title'], dct['description'], frame, scenes)
             self.add_signage(new_signage)
 
-            utils.logger.info('{} loaded from a file'.format(new_signage.title))
+            utils.logger.info('{} loaded from a {}'.format(new_signage.title, 'snapshot' if snapshot else 'file'))
+
+        if snapshot is not None:
+            self._snapshot_fingerprint = fingerprint
+        elif self._use_snapshot:
+            self.save_snapshot()
 
     def add_signage(self, new_signage: Signage) -> None:
         def id_change_handler(old_id, new_id):
@@ -469,19 +881,42 @@ class SignageManager:
             for ref in refs.values():
                 ref.value_change_handler(ref)
 
-            os.remove(str(signage_path))
+            self._writer.delete(signage_path)
 
         def value_change_handler():
             signage_path = self._root_dir / (new_signage.id + '.json')
-            with signage_path.open('w') as f:
-                f.write(json.dumps(new_signage.to_dict()))
+            self._writer.schedule(signage_path, json.dumps(new_signage.to_dict()))
+
+            self._update_dependencies(new_signage)
+            self._dependency_graph.invalidate([new_signage])  # channels showing this signage
+            self._change_event_handler(new_signage)
 
         new_signage.on_id_change = id_change_handler
         new_signage.on_value_change = value_change_handler
+        self._dependency_graph.set_invalidation_handler(new_signage, Signage.invalidate)
 
         self._signages[new_signage.id] = new_signage
 
-        value_change_handler()  # save to file
+        if self._loading:
+            self._update_dependencies(new_signage)
+        else:
+            value_change_handler()  # save to file
+
+    def _update_dependencies(self, signage: Signage) -> None:
+        # a signage depends on values and templates of its frame and scenes.
+        # the values depend on values embedded in them.
+        values = [signage.frame.values] + [scene.values for scene in signage.scenes]
+        templates = [signage.frame.template] + [scene.template for scene in signage.scenes]
+
+        for removed in self._dependency_graph.get_dependencies(signage) - set(values):
+            if isinstance(removed, ObjectValue):
+                self._dependency_graph.remove_node(removed)
+
+        for value in values:
+            self._dependency_graph.set_dependencies(value, value.get_references())
+            self._dependency_graph.set_invalidation_handler(value, ObjectValue.invalidate)
+
+        self._dependency_graph.set_dependencies(signage, values + templates)
 
     def remove_signage(self, to_delete: Signage):
         refs = {'channel/{}'.format(channel.id): channel
@@ -491,28 +926,54 @@ class SignageManager:
             raise ReferenceError(refs)
 
         delete_path = self._root_dir / (to_delete.id + '.json')
-        os.remove(str(delete_path))
+        self._writer.delete(delete_path)
+
+        del self._signages[to_delete.id]
+
+        for value in self._dependency_graph.get_dependencies(to_delete):
+            if isinstance(value, ObjectValue):
+                self._dependency_graph.remove_node(value)
+
+        self._dependency_graph.remove_node(to_delete)
+        self._change_event_handler(to_delete)
+
+    # only signages having a frame or scene value which references the target are checked
+    def _get_referencing_signages(self, to_check) -> List[Signage]:
+        return [signage
+                for value in self._dependency_graph.get_dependents(to_check)
+                if isinstance(value, ObjectValue) and value.id is None
+                for signage in self._dependency_graph.get_dependents(value)]
 
     def get_value_references(self, to_check) -> Dict[str, ObjectValue]:
-        return {'signage/{}.{}'.format(signage.id, k): v for signage in self._signages.values() for k, v in signage.get_value_references(to_check).items()}
+        return {'signage/{}.{}'.format(signage.id, k): v
+                for signage in self._get_referencing_signages(to_check)
+                for k, v in signage.get_value_references(to_check).items()}
 
     def get_scene_template_references(self, to_check) -> Dict[str, Scene]:
         return {'signage/{}.{}'.format(signage.id, k): v
-                for signage in self._signages.values()
+                for signage in self._dependency_graph.get_dependents(to_check)
                 for k, v in signage.get_scene_template_references(to_check).items()}
 
     def get_frame_template_references(self, to_check) -> Dict[str, Frame]:
         return {'signage/{}.frame'.format(signage.id): signage.frame
-                for signage in filter(lambda x: x.frame.template is to_check, self._signages.values())}
+                for signage in filter(lambda x: x.frame.template is to_check,
+                                      self._dependency_graph.get_dependents(to_check))}
 
 
 class ChannelManager:
     from model.channel import Channel  # due to cyclic import problem, import Channel class locally.
 
-    def __init__(self, root_dir: Path, sgn_mng: SignageManager):
+    load_workers = 8
+
+    def __init__(self, root_dir: Path, sgn_mng: SignageManager, use_snapshot: bool=False):
         self._root_dir = root_dir
         self._channels = dict()
         self._sgn_mng = sgn_mng
+        self._dependency_graph = sgn_mng.dependency_graph
+        self._writer = WriteBehindWriter()
+        self._loading = False
+        self._use_snapshot = use_snapshot
+        self._snapshot_fingerprint = None
 
         self._redirect_event_handler = lambda channel, old_id: None
         self._count_event_handler = lambda channel: 0
@@ -527,6 +988,25 @@ class ChannelManager:
     def channels(self) -> Dict[str, Channel]:
         return copy.copy(self._channels)
 
+    @property
+    def writer(self) -> WriteBehindWriter:
+        return self._writer
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self._root_dir.with_name(self._root_dir.name + '.snapshot')
+
+    def flush(self) -> None:
+        self._writer.flush()
+
+        if self._use_snapshot and get_directory_fingerprint(self._root_dir) != self._snapshot_fingerprint:
+            self.save_snapshot()
+
+    def save_snapshot(self) -> None:
+        fingerprint = get_directory_fingerprint(self._root_dir)
+        write_snapshot(self.snapshot_path, fingerprint, {x: y.to_dict() for x, y in self._channels.items()})
+        self._snapshot_fingerprint = fingerprint
+
     @property
     def redirect_event_handler(self) -> Callable[['Channel', str], None]:
         return self._redirect_event_handler
@@ -546,18 +1026,35 @@ class ChannelManager:
     def get_channel(self, channel_id: str) -> Channel:
         return self._channels[channel_id]
 
-    def load_all(self):
+    def load_all(self) -> None:
+        self._loading = True
+        try:
+            self._load_files()
+        finally:
+            self._loading = False
+
+    def _load_files(self) -> None:
         self._channels = dict()
 
-        for channel_id, channel_file in [(x.stem, x) for x in self._root_dir.glob('*.json')]:
-            # load from the signage file
-            with channel_file.open(encoding='UTF-8') as f:
-                dct = json.load(f)
+        fingerprint = get_directory_fingerprint(self._root_dir) if self._use_snapshot else None
+        snapshot = read_snapshot(self.snapshot_path, fingerprint) if self._use_snapshot else None
+
+        if snapshot is not None:
+            channel_contents = ((x, snapshot[x]) for x in snapshot.keys())
+        else:
+            channel_files = list(self._root_dir.glob('*.json'))
+            channel_contents = zip([x.stem for x in channel_files], read_json_files(channel_files, self.load_workers))
 
+        for channel_id, dct in channel_contents:
             from model.channel import Channel
             new_channel = Channel(channel_id, dct['description'], self._sgn_mng.get_signage(dct['signage']))
             self.add_channel(new_channel)
 
+        if snapshot is not None:
+            self._snapshot_fingerprint = fingerprint
+        elif self._use_snapshot:
+            self.save_snapshot()
+
     def add_channel(self, new_channel: Channel) -> None:
         def id_change_handler(channel, old_id):
             channel_path = self._root_dir / (old_id + '.json')
@@ -565,25 +1062,59 @@ class ChannelManager:
             del self._channels[old_id]
             self._channels[channel.id] = channel
 
-            os.remove(str(channel_path))
+            self._writer.delete(channel_path)
 
         def value_change_handler(channel):
             channel_path = self._root_dir / (channel.id + '.json')
+            self._writer.schedule(channel_path, json.dumps(channel.to_dict()))
 
-            with channel_path.open('w') as f:
-                f.write(json.dumps(channel.to_dict()))
+            self._dependency_graph.set_dependencies(channel, [channel.signage])
 
         new_channel.id_change_handler = id_change_handler
         new_channel.value_change_handler = value_change_handler
         new_channel.redirect_event_handler = lambda channel, old_id: self._redirect_event_handler(channel, old_id)
         new_channel.count_event_handler = lambda channel: self._count_event_handler(channel)
+        self._dependency_graph.set_invalidation_handler(new_channel, self.Channel.request_refresh)
 
         self._channels[new_channel.id] = new_channel
 
-        value_change_handler(new_channel)  # save to file
+        if self._loading:
+            self._dependency_graph.set_dependencies(new_channel, [new_channel.signage])
+        else:
+            value_change_handler(new_channel)  # save to file
 
     def remove_channel(self, to_delete: Channel):
         pass
 
     def get_signage_references(self, to_check: Signage) -> Dict[str, Channel]:
-        return {channel.id: channel for channel in filter(lambda x: x.signage is to_check, self.channels.values())}
+        # channels are the only nodes depending on a signage
+        return {channel.id: channel for channel in self._dependency_graph.get_dependents(to_check)}
+
+
+class Managers(NamedTuple):
+    mtm_mng: MultimediaManager
+    obj_mng: ObjectManager
+    tpl_mng: TemplateManager
+    sgn_mng: SignageManager
+    chn_mng: ChannelManager
+
+    # writes pending changes of every manager
+    def flush(self) -> None:
+        for manager in (self.obj_mng, self.sgn_mng, self.chn_mng):
+            manager.flush()
+
+
+# loads every manager from a data directory and binds them to each other
+def load_managers(root_path: Path, use_snapshot: bool=False, lazy_values: bool=False) -> Managers:
+    mtm_mng = MultimediaManager(root_path / 'media')
+    obj_mng = ObjectManager(root_path / 'data', mtm_mng, use_snapshot, lazy_values)
+    tpl_mng = TemplateManager(root_path / 'template', obj_mng)
+    sgn_mng = SignageManager(root_path / 'signage', obj_mng, tpl_mng, use_snapshot)
+    chn_mng = ChannelManager(root_path / 'channel', sgn_mng, use_snapshot)
+
+    mtm_mng.bind_managers(sgn_mng, obj_mng)
+    obj_mng.bind_managers(tpl_mng, sgn_mng)
+    tpl_mng.bind_managers(sgn_mng)
+    sgn_mng.bind_managers(chn_mng)
+
+    return Managers(mtm_mng, obj_mng, tpl_mng, sgn_mng, chn_mng)
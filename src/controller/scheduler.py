@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from controller.manager import SignageManager, ChannelManager
+from model.signage import Signage
+from utils import logger
+
+
+class ScheduleWatcher:
+    # refreshes channels when a scene of their signage is shown or hidden by its schedule.
+    # the next change of every signage is kept in a heap, and a thread sleeps until the earliest one.
+    # nothing runs between changes, however many signages there are.
+    max_wait = 3600  # seconds. the clock may be adjusted while waiting, so check it at least this often
+
+    def __init__(self, sgn_mng: SignageManager, chn_mng: ChannelManager,
+                 clock: Callable[[], datetime]=datetime.now):
+        self._sgn_mng = sgn_mng
+        self._chn_mng = chn_mng
+        self._clock = clock
+
+        self._heap = []  # type: List[Tuple[datetime, int, Signage]]
+        self._next_changes = dict()  # type: Dict[Signage, datetime]
+        self._sequence = itertools.count()  # signages are not compared in the heap
+
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._refreshes = 0
+
+    @property
+    def next_change(self) -> Optional[datetime]:
+        with self._condition:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    @property
+    def refreshes(self) -> int:
+        return self._refreshes
+
+    def start(self) -> None:
+        with self._condition:
+            if self._running:
+                return
+
+            self._running = True
+
+        self._sgn_mng.change_event_handler = self.update
+
+        for signage in self._sgn_mng.signages.values():
+            self.update(signage)
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._sgn_mng.change_event_handler = lambda signage: None
+
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # schedules the next change of a changed signage. a removed signage is forgotten.
+    def update(self, signage: Signage) -> None:
+        self._update(signage, self._clock())
+
+    # refreshes channels of signages changing until the given moment, and returns the signages.
+    # a signage failing to refresh its channels is logged, and scheduled again as the others.
+    def run_pending(self, now: datetime) -> List[Signage]:
+        due = []
+
+        with self._condition:
+            while True:
+                self._drop_stale()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+
+                _, _, signage = heapq.heappop(self._heap)
+                del self._next_changes[signage]
+                due.append(signage)
+
+        for signage in due:
+            try:
+                for channel in self._chn_mng.get_signage_references(signage).values():
+                    channel.request_refresh()
+                    self._refreshes += 1
+            except Exception as e:
+                logger.error('failed to refresh channels of {} signage: {}'.format(signage.id, e))
+            finally:
+                self._update(signage, now)
+
+        return due
+
+    def _update(self, signage: Signage, now: datetime) -> None:
+        try:
+            removed = self._sgn_mng.get_signage(signage.id) is not signage
+        except KeyError:
+            removed = True
+
+        with self._condition:
+            if removed:
+                self._next_changes.pop(signage, None)
+            else:
+                self._schedule(signage, signage.next_change(now))
+
+    def _schedule(self, signage: Signage, moment: Optional[datetime]) -> None:
+        if moment is None:
+            self._next_changes.pop(signage, None)
+            return
+
+        if self._next_changes.get(signage) == moment:
+            return
+
+        # an entry of the old moment stays in the heap. it is dropped when it reaches the top.
+        self._next_changes[signage] = moment
+        heapq.heappush(self._heap, (moment, next(self._sequence), signage))
+
+        if self._heap[0][2] is signage:
+            self._condition.notify()  # earlier than the change the thread is waiting for
+
+    def _drop_stale(self) -> None:
+        while self._heap and self._next_changes.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+
+                self._drop_stale()
+                wait = self.max_wait
+                if self._heap:
+                    wait = min(wait, (self._heap[0][0] - self._clock()).total_seconds())
+
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+            try:
+                self.run_pending(self._clock())
+            except Exception as e:
+                logger.error('failed to refresh scheduled channels: {}'.format(e))
@@ -1,8 +1,10 @@
 import copy
 import sys
 from datetime import datetime
+from enum import Enum, auto
 from pathlib import Path
-from typing import TypeVar, Generic, Sequence, Dict, Tuple
+from types import MappingProxyType
+from typing import TypeVar, Generic, Sequence, Dict, Tuple, FrozenSet, NamedTuple, Callable, Any, Mapping, List
 
 from model.data_value import ObjectValue, FileValue
 
@@ -15,13 +17,39 @@ T = TypeVar('T')
 class DataType(Generic[T]):
     def __init__(self, default: T):
         self._default = default
+        self._validator = None  # compiled from constraints on first use. set to None when they change.
 
     @property
     def default(self):
         return copy.copy(self._default)
 
     def is_valid(self, value: T):
-        return value is not None
+        validator = self._validator
+        if validator is None:
+            validator = self._validator = self._compile_validator()
+
+        return validator(value)
+
+    # returns indexes of invalid values
+    def validate_batch(self, values: Sequence[T]) -> List[int]:
+        validator = self._get_validator()
+
+        # most batches are valid. check them without building a result first.
+        if all(map(validator, values)):
+            return []
+
+        return [index for index, value in enumerate(values) if not validator(value)]
+
+    def _get_validator(self) -> Callable[[T], bool]:
+        if self._validator is None:
+            self._validator = self._compile_validator()
+
+        return self._validator
+
+    # returns a function checking the constraints of this type.
+    # constraints are read once here, not on every check.
+    def _compile_validator(self) -> Callable[[T], bool]:
+        return lambda value: value is not None
 
 
 class StringDataType(DataType[str]):
@@ -45,6 +73,7 @@ class StringDataType(DataType[str]):
             raise AttributeError()
 
         self._min_length = new_value
+        self._validator = None
 
     @property
     def max_length(self) -> int:
@@ -56,6 +85,7 @@ class StringDataType(DataType[str]):
             raise AttributeError()
 
         self._max_length = new_value
+        self._validator = None
 
     @property
     def one_of(self) -> Sequence[str]:
@@ -67,9 +97,17 @@ class StringDataType(DataType[str]):
             raise AttributeError()
 
         self._one_of = new_value[:]
+        self._validator = None
+
+    def _compile_validator(self) -> Callable[[str], bool]:
+        min_length = self._min_length
+        max_length = self._max_length
+        one_of = frozenset(self._one_of)
 
-    def is_valid(self, value: str):
-        return self._min_length <= len(value) <= self._max_length and (value in self._one_of if self._one_of else True)
+        if one_of:
+            return lambda value: min_length <= len(value) <= max_length and value in one_of
+
+        return lambda value: min_length <= len(value) <= max_length
 
 
 class IntegerDataType(DataType[int]):
@@ -93,6 +131,7 @@ class IntegerDataType(DataType[int]):
             raise AttributeError()
 
         self._min = new_value
+        self._validator = None
 
     @property
     def max(self) -> int:
@@ -104,6 +143,7 @@ class IntegerDataType(DataType[int]):
             raise AttributeError()
 
         self._max = new_value
+        self._validator = None
 
     @property
     def one_of(self) -> Sequence[int]:
@@ -115,9 +155,31 @@ class IntegerDataType(DataType[int]):
             raise AttributeError
 
         self._one_of = new_value[:]
+        self._validator = None
+
+    def _compile_validator(self) -> Callable[[int], bool]:
+        min_value = self._min
+        max_value = self._max
+        one_of = frozenset(self._one_of)
+
+        if one_of:
+            return lambda value: min_value <= value <= max_value and value in one_of
+
+        return lambda value: min_value <= value <= max_value
+
+
+class FieldKind(Enum):
+    PRIMITIVE = auto()  # stored as it is
+    DATE = auto()
+    OBJECT = auto()
+    OBJECT_LIST = auto()
+    FILE = auto()
+
 
-    def is_valid(self, value: int):
-        return self._min <= value <= self._max and (value in self._one_of if self._one_of else True)
+class FieldSchema(NamedTuple):
+    data_type: DataType
+    kind: FieldKind  # how a value in a file is converted to a python object
+    validator: Callable[[Any], bool]
 
 
 class ObjectDataType(DataType[ObjectValue]):
@@ -134,6 +196,14 @@ class ObjectDataType(DataType[ObjectValue]):
         self._description = description
         self._fields = fields
 
+        # fields don't change after a type is created. values read this schema instead of copying fields.
+        self._schema = MappingProxyType({key: FieldSchema(x[0], get_field_kind(x[0]), x[0].is_valid)
+                                         for key, x in fields.items()})
+        self._referenced_types = frozenset(x[0] if not isinstance(x[0], ListDataType) else x[0].data_type
+                                           for x in fields.values())
+        self._reference_fields = frozenset(key for key, x in self._schema.items()
+                                           if x.kind in (FieldKind.OBJECT, FieldKind.OBJECT_LIST, FieldKind.FILE))
+
         super().__init__('')
         # super().__init__({key: value[0].default for key, value in fields.items()})
 
@@ -161,14 +231,25 @@ class ObjectDataType(DataType[ObjectValue]):
     def fields(self) -> Dict[str, Tuple[DataType, str, str]]:
         return copy.copy(self._fields)
 
-    def is_valid(self, value: ObjectValue):
-        if value is None:
-            return True
+    @property
+    def schema(self) -> Mapping[str, FieldSchema]:
+        return self._schema
+
+    def _compile_validator(self) -> Callable[[ObjectValue], bool]:
+        # fields of the value are validated when they are set. don't resolve them again.
+        return lambda value: value is None or value.data_type is self
 
-        return all([field_type[0].is_valid(value.get_value(field_key)) for field_key, field_type in self._fields.items()])
+    @property
+    def referenced_types(self) -> FrozenSet[DataType]:
+        return self._referenced_types
+
+    # keys of fields holding object values or files
+    @property
+    def reference_fields(self) -> FrozenSet[str]:
+        return self._reference_fields
 
     def has_references(self, to_check) -> bool:
-        return to_check in [x[0] if not isinstance(x[0], ListDataType) else x[0].data_type for x in self._fields.values()]
+        return to_check in self._referenced_types
 
 
 class BooleanDataType(DataType[bool]):
@@ -200,6 +281,7 @@ class DateDataType(DataType[str]):
             raise AttributeError()
 
         self._min = new_datetime
+        self._validator = None
 
     @property
     def max(self) -> str:
@@ -213,11 +295,21 @@ class DateDataType(DataType[str]):
             raise AttributeError()
 
         self._max = new_datetime
+        self._validator = None
+
+    def _compile_validator(self) -> Callable[[Any], bool]:
+        min_value = self._min
+        max_value = self._max
+        date_format = DateDataType.format
 
-    def is_valid(self, value: str):
-        new_datetime = datetime.strptime(value, DateDataType.format) if isinstance(value, str) else value
+        def validator(value) -> bool:
+            # values are converted to datetime before they are set. parse strings from the ui only.
+            if isinstance(value, str):
+                value = datetime.strptime(value, date_format)
 
-        return self._min <= new_datetime <= self._max
+            return min_value <= value <= max_value
+
+        return validator
 
 
 class ListDataType(DataType[list]):
@@ -240,8 +332,12 @@ class ListDataType(DataType[list]):
     def data_type(self) -> DataType:
         return self._data_type
 
-    def is_valid(self, value: list):
-        return all([self._data_type.is_valid(x) for x in value])
+    def _compile_validator(self) -> Callable[[list], bool]:
+        data_type = self._data_type
+
+        # constraints of the element type may change later. get its validator on every check, not on every element.
+        # stops at the first invalid element
+        return lambda value: all(map(data_type._get_validator(), value))
 
 
 class FileDataType(DataType[str]):
@@ -253,14 +349,32 @@ class FileDataType(DataType[str]):
     def root_dir(self) -> Path:
         return self._root_dir
 
-    def is_valid(self, value: str) -> bool:
-        if not value:
-            return True
+    def _compile_validator(self) -> Callable[[Any], bool]:
+        root_dir = self._root_dir
+
+        def validator(value) -> bool:
+            if not value:
+                return True
+
+            if isinstance(value, FileValue):
+                return True  # todo
+
+            return (root_dir / value).exists()
+
+        return validator
+
 
-        if isinstance(value, FileValue):
-            return True  # todo
+def get_field_kind(field_type: DataType) -> FieldKind:
+    if isinstance(field_type, DateDataType):
+        return FieldKind.DATE
+    elif isinstance(field_type, ObjectDataType):
+        return FieldKind.OBJECT
+    elif isinstance(field_type, ListDataType) and isinstance(field_type.data_type, ObjectDataType):
+        return FieldKind.OBJECT_LIST
+    elif isinstance(field_type, FileDataType):
+        return FieldKind.FILE
 
-        return (self._root_dir / value).exists()
+    return FieldKind.PRIMITIVE
 
 
 STR_TO_PRIMITIVE_TYPE = {
@@ -9,11 +9,22 @@ from utils import utils
 T = TypeVar('T')
 
 
+# default handlers. they are shared by all instances not to create a function per instance.
+def _ignore_id_change(value, old_id: str, new_id: str) -> None:
+    pass
+
+
+def _ignore_value_change(value) -> None:
+    pass
+
+
 class FileValue:
+    __slots__ = ('_data_type', '_file_name', '_on_id_change_handler')
+
     def __init__(self, file_type: 'data_type.FileDataType', file_name: str):
         self._data_type = file_type
         self._file_name = ''
-        self._on_id_change_handler = lambda old_id, new_id: None
+        self._on_id_change_handler = _ignore_id_change
 
         self._file_name = file_name  # set with is_valid methods
 
@@ -27,7 +38,7 @@ class FileValue:
 
         old_name = self._file_name
         self._file_name = new_name
-        self._on_id_change_handler(old_name, new_name)
+        self._on_id_change_handler(self, old_name, new_name)
 
     @property
     def file_path(self) -> Path:
@@ -37,32 +48,43 @@ class FileValue:
     def on_id_change(self) -> None:
         raise ValueError  # don't try to access!
 
+    # (file, old_name, new_name)
     @on_id_change.setter
-    def on_id_change(self, handler: Callable[[str, str], None]) -> None:
+    def on_id_change(self, handler: Callable[['FileValue', str, str], None]) -> None:
         self._on_id_change_handler = handler
 
 
 class ObjectValue:
+    __slots__ = ('_id', '_values', '_raw_values', '_version', '_cached_values', '_data_type',
+                 '_id_change_handler', '_value_change_handler', '_obj_mng', '_mtm_mng')
+
     def __init__(self, object_id: Optional[str],
                  object_type: 'data_type.ObjectDataType',
                  obj_mng: 'manager.ObjectManager',
-                 mtm_mng: 'manager.MultimediaManager'):
+                 mtm_mng: 'manager.MultimediaManager',
+                 lazy: bool=False):
         self._id = ''
         self._values = {}
+        self._raw_values = {}  # fields which are not resolved yet
+        self._version = 0
+        self._cached_values = None  # use_reference -> (version, values)
         self._data_type = object_type
-        self._id_change_handler = lambda x, y: None
-        self._value_change_handler = lambda: None
+        self._id_change_handler = _ignore_id_change
+        self._value_change_handler = _ignore_value_change
         self._obj_mng = obj_mng  # I hope this reference could be removed...
         self._mtm_mng = mtm_mng
 
         self.id = object_id
 
-        for field_key, field_type in object_type.fields.items():
-            self.set_value(field_key, field_type[0].default)
+        for field_key, field in object_type.schema.items():
+            self._raw_values[field_key] = field.data_type.default
+
+        if not lazy:
+            self._resolve_values()
 
     def set_value(self, key: str, value: Any) -> None:
         self._set_value(key, value)
-        self._value_change_handler()
+        self._value_change_handler(self)
 
     # if multiple values should be changed, use this method instead of 'set_value'
     # if you don't, change handler will be called whenever single value is changed.
@@ -70,35 +92,75 @@ class ObjectValue:
         for key, value in values.items():
             self._set_value(key, value)
 
-        self._value_change_handler()
+        self._value_change_handler(self)
+
+    # stores values read from a file without converting and validating them.
+    # each field is resolved on its first access. fields referencing other values are resolved at once,
+    # so that references are tracked from the start.
+    def load_values(self, **values):
+        schema = self._data_type.schema
+
+        for key, value in values.items():
+            if key not in schema:
+                raise KeyError
+
+            self._raw_values[key] = value
+
+        self._resolve_values(self._data_type.reference_fields)
+
+    def _resolve_values(self, keys=None) -> None:
+        for key in [x for x in self._raw_values.keys() if keys is None or x in keys]:
+            self._set_value(key, self._raw_values[key])
+
+        if not self._raw_values:
+            self._raw_values = {}  # an emptied dict keeps its table. replace it with a new one.
 
     def _set_value(self, key: str, value: Any):
-        if key not in self._data_type.fields.keys():
+        field = self._data_type.schema.get(key)
+        if field is None:
             raise KeyError
 
-        field_type = self._data_type.fields[key][0]
-
-        if isinstance(field_type, data_type.DateDataType):
-            value = datetime.strptime(value, data_type.DateDataType.format)
-        elif isinstance(field_type, data_type.ObjectDataType):
-            value = self._obj_mng.get_object_value(field_type, value) if self._obj_mng else None
-        elif isinstance(field_type, data_type.ListDataType) and \
-                isinstance(field_type.data_type, data_type.ObjectDataType):
-            value = [self._obj_mng.get_object_value(field_type.data_type, x) for x in value]
-        elif field_type is self._mtm_mng.image_type:
-            value = self._mtm_mng.get_image(value)
-        elif field_type is self._mtm_mng.video_type:
-            value = self._mtm_mng.get_video(value)
-
-        if not self._data_type.fields[key][0].is_valid(value):
+        if field.kind is not data_type.FieldKind.PRIMITIVE:
+            value = self._convert(field, value)
+
+        if not field.validator(value):
             raise AttributeError
 
         self._values[key] = value
+        self._raw_values.pop(key, None)
+        self._version += 1
+
+    def _convert(self, field: 'data_type.FieldSchema', value: Any) -> Any:
+        kind = field.kind
+
+        if kind is data_type.FieldKind.DATE:
+            return datetime.strptime(value, data_type.DateDataType.format)
+        elif kind is data_type.FieldKind.OBJECT:
+            return self._obj_mng.get_object_value(field.data_type, value) if self._obj_mng else None
+        elif kind is data_type.FieldKind.OBJECT_LIST:
+            return [self._obj_mng.get_object_value(field.data_type.data_type, x) for x in value]
+        elif kind is data_type.FieldKind.FILE:
+            return self._mtm_mng.get_file(field.data_type, value)
+
+        return value
 
     def get_value(self, key: str):
+        if key in self._raw_values:
+            self._set_value(key, self._raw_values[key])
+
         return self._values[key]
 
-    def get_values(self, use_reference: bool=True):
+    # results are cached until this value or a value embedded in it is changed. don't modify them.
+    # pass cache=False when values are read once, e.g. to export them, not to keep a dict for every value.
+    def get_values(self, use_reference: bool=True, cache: bool=True):
+        cached = self._cached_values.get(use_reference) if self._cached_values is not None else None
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+
+        if use_reference:
+            self._resolve_values()
+
+        version = self._version
         to_return = {x: y for x, y in self._values.items()}
 
         for field_id, field_value in to_return.items():
@@ -111,10 +173,39 @@ class ObjectValue:
             elif isinstance(field_value, FileValue):
                 to_return[field_id] = field_value.file_name if use_reference else field_value.file_name # TODO
 
+        # fields not resolved yet are kept as they are read, in the form of a file
+        to_return.update(self._raw_values)
+
+        if cache:
+            if self._cached_values is None:
+                self._cached_values = {}
+
+            self._cached_values[use_reference] = (version, to_return)
+
         return to_return
 
+    @property
+    def version(self) -> int:
+        return self._version
+
+    # called when a value embedded in this value is changed
+    def invalidate(self) -> None:
+        self._version += 1
+
     def has_references(self, to_check) -> bool:
-        return any([to_check is x if not isinstance(x, list) else to_check in x for x in self._values.values()])
+        return any(to_check is x if not isinstance(x, list) else to_check in x for x in self._values.values())
+
+    # returns object values and files embedded in this value
+    def get_references(self) -> List[Any]:
+        references = []
+
+        for field_value in self._values.values():
+            if isinstance(field_value, (ObjectValue, FileValue)):
+                references.append(field_value)
+            elif isinstance(field_value, list):
+                references.extend([x for x in field_value if isinstance(x, (ObjectValue, FileValue))])
+
+        return references
 
     @property
     def id(self) -> Optional[str]:
@@ -126,8 +217,8 @@ class ObjectValue:
 
         old_id = self._id
         self._id = new_id
-        self._id_change_handler(old_id, new_id)
-        self._value_change_handler()
+        self._id_change_handler(self, old_id, new_id)
+        self._value_change_handler(self)
 
     @property
     def data_type(self) -> 'data_type.ObjectDataType':
@@ -137,15 +228,15 @@ class ObjectValue:
     def on_id_change(self) -> None:
         raise ValueError  # don't try to access!
 
-    # (old_id, new_id)
+    # (value, old_id, new_id)
     @on_id_change.setter
-    def on_id_change(self, handler: Callable[[str, str], None]) -> None:
+    def on_id_change(self, handler: Callable[['ObjectValue', str, str], None]) -> None:
         self._id_change_handler = handler
 
     @property
-    def on_value_change(self) -> Callable[[None], None]:
+    def on_value_change(self) -> Callable[['ObjectValue'], None]:
         return self._value_change_handler
 
     @on_value_change.setter
-    def on_value_change(self, handler: Callable[[None], None]) -> None:
+    def on_value_change(self, handler: Callable[['ObjectValue'], None]) -> None:
         self._value_change_handler = handler
@@ -1,18 +1,21 @@
+import hashlib
 import json
-from datetime import time
+from datetime import time, datetime, timedelta
 from pathlib import Path
 
 from enum import Enum, auto
-from typing import Callable, Tuple, List, Dict
-
-from jinja2.environment import Environment
-from jinja2.loaders import FileSystemLoader
+from typing import Callable, Tuple, List, Dict, Optional
 
 from model.data_value import ObjectValue
-from model.template import SceneTemplate, FrameTemplate
+from model.template import Template, SceneTemplate, FrameTemplate, template_cache, extract_resources
 from utils import utils
 
 
+# default handler shared by all instances not to create a function per instance
+def _ignore_change() -> None:
+    pass
+
+
 class ScheduleType(Enum):
     ALWAYS_VISIBLE = auto()
     ALWAYS_HIDDEN = auto()
@@ -27,13 +30,15 @@ class TransitionType(Enum):
 
 
 class Schedule:
+    __slots__ = ('_type', '_from', '_to', '_day_of_week', '_on_change_handler')
+
     def __init__(self, schedule_type: ScheduleType):
         self._type = schedule_type
         self._from = time(0, 0, 0)
         self._to = time(23, 59, 59)
         self._day_of_week = [True] * 7  # Sun ~ Sat
 
-        self._on_change_handler = lambda: None
+        self._on_change_handler = _ignore_change
 
     @property
     def type(self) -> ScheduleType:
@@ -82,6 +87,39 @@ class Schedule:
     def on_value_change(self, handler: Callable[[None], None]) -> None:
         self._on_change_handler = handler
 
+    def is_visible(self, moment: datetime) -> bool:
+        if self._type is ScheduleType.ALWAYS_VISIBLE:
+            return True
+        elif self._type is ScheduleType.ALWAYS_HIDDEN:
+            return False
+
+        # times are compared in seconds. a scene is on time until the second of to_time ends.
+        moment_time = moment.time().replace(microsecond=0)
+        on_time = self._day_of_week[(moment.weekday() + 1) % 7] and self._from <= moment_time <= self._to
+
+        return on_time if self._type is ScheduleType.VISIBLE_ON_TIME else not on_time
+
+    # returns the first moment after the given one when the visibility changes, or None if it never changes
+    def next_change(self, moment: datetime) -> Optional[datetime]:
+        if self._type in (ScheduleType.ALWAYS_VISIBLE, ScheduleType.ALWAYS_HIDDEN):
+            return None
+
+        visible = self.is_visible(moment)
+
+        # visibility changes only at from_time, after to_time or at midnight. a week covers every day.
+        boundaries = []
+        for days in range(8):
+            day = moment.date() + timedelta(days=days)
+            boundaries.append(datetime.combine(day, time(0, 0, 0)))
+            boundaries.append(datetime.combine(day, self._from))
+            boundaries.append(datetime.combine(day, self._to) + timedelta(seconds=1))
+
+        for boundary in sorted(x for x in boundaries if x > moment):
+            if self.is_visible(boundary) != visible:
+                return boundary
+
+        return None
+
     def to_dict(self) -> dict:
         return {
             "type": self.type.name,
@@ -92,6 +130,8 @@ class Schedule:
 
 
 class Scene:
+    __slots__ = ('_template', '_duration', '_transition', '_schedule', '_values', '_on_change_handler')
+
     def __init__(self, template: SceneTemplate, object_value: ObjectValue, duration: int=10,
                  transition: TransitionType=TransitionType.NONE,
                  schedule: Schedule=None):
@@ -103,13 +143,16 @@ class Scene:
         self._transition = transition
         self._schedule = schedule
         self._values = object_value
-        self._on_change_handler = lambda: None
+        self._on_change_handler = _ignore_change
+
+        self._values.on_value_change = self._values_handler_wrapper
+        self._schedule.on_value_change = self._handler_wrapper
 
-        def object_value_change_handler():
-            self._on_change_handler()
+    def _handler_wrapper(self):
+        self._on_change_handler()
 
-        self._values.on_value_change = object_value_change_handler
-        self._schedule.on_value_change = object_value_change_handler
+    def _values_handler_wrapper(self, values: ObjectValue):
+        self._on_change_handler()
 
     @property
     def template(self) -> SceneTemplate:
@@ -119,6 +162,7 @@ class Scene:
     def template(self, new_template: SceneTemplate) -> None:
         self._template = new_template
         self._values = ObjectValue(None, new_template.definition, self._values._obj_mng, self._values._mtm_mng)
+        self._values.on_value_change = self._values_handler_wrapper
         self._on_change_handler()
 
     @property
@@ -169,15 +213,17 @@ class Scene:
 
 
 class Frame:
+    __slots__ = ('_template', '_values', '_on_change_handler')
+
     def __init__(self, template: FrameTemplate, object_value: ObjectValue):
         self._template = template
         self._values = object_value
-        self._on_change_handler = lambda: None
+        self._on_change_handler = _ignore_change
 
-        def object_value_change_handler():
-            self._on_change_handler()
+        self._values.on_value_change = self._values_handler_wrapper
 
-        self._values.on_value_change = object_value_change_handler
+    def _values_handler_wrapper(self, values: ObjectValue):
+        self._on_change_handler()
 
     @property
     def template(self) -> FrameTemplate:
@@ -187,6 +233,7 @@ class Frame:
     def template(self, new_template: FrameTemplate) -> None:
         self._template = new_template
         self._values = ObjectValue(None, new_template.definition, self._values._obj_mng, self._values._mtm_mng)
+        self._values.on_value_change = self._values_handler_wrapper
         self._on_change_handler()
 
     @property
@@ -223,6 +270,11 @@ class Signage:
         self._id_change_handler = lambda x, y: None
         self._value_change_handler = lambda: None
 
+        # rendered page is cached until the content version is changed
+        self._version = 0
+        self._parts = None
+        self._rendered = None
+
         self.id = signage_id  # validate new id
 
         for scene in scenes:
@@ -231,6 +283,7 @@ class Signage:
         self._frame.on_value_change = self._handler_wrapper
 
     def _handler_wrapper(self):
+        self.invalidate()
         self._value_change_handler()
 
     @property
@@ -244,7 +297,7 @@ class Signage:
         old_id = self._id
         self._id = new_id
         self._id_change_handler(old_id, new_id)
-        self._value_change_handler()
+        self._handler_wrapper()
 
     @property
     def title(self) -> str:
@@ -254,7 +307,7 @@ class Signage:
     def title(self, new_title: str) -> None:
         self._title = new_title
 
-        self._value_change_handler()
+        self._handler_wrapper()
 
     @property
     def description(self) -> str:
@@ -264,7 +317,7 @@ class Signage:
     def description(self, new_value: str) -> None:
         self._description = new_value
 
-        self._value_change_handler()
+        self._handler_wrapper()
 
     @property
     def scenes(self) -> Tuple[Scene]:
@@ -274,6 +327,10 @@ class Signage:
     def frame(self) -> Frame:
         return self._frame
 
+    @property
+    def version(self) -> int:
+        return self._version
+
     @property
     def on_id_change(self) -> None:
         raise ValueError  # don't try to access!
@@ -299,22 +356,25 @@ class Signage:
             "scenes": [x.to_dict() for x in self.scenes]
         }
 
+    def invalidate(self) -> None:
+        self._version += 1
+
     def add_scene(self, new_scene: Scene) -> None:
         new_scene.on_value_change = self._handler_wrapper
         self._scenes.append(new_scene)
-        self._value_change_handler()
+        self._handler_wrapper()
 
     def remove_scene(self, to_delete: Scene) -> None:
-        to_delete.on_value_change = lambda: None
+        to_delete.on_value_change = _ignore_change
         self._scenes.remove(to_delete)
-        self._value_change_handler()
+        self._handler_wrapper()
 
     def rearrange_scene(self, index_1: int, index_2: int) -> None:
         self._scenes[index_1], self._scenes[index_2] = self._scenes[index_2], self._scenes[index_1]
-        self._value_change_handler()
+        self._handler_wrapper()
 
     def get_value_references(self, to_check) -> Dict[str, ObjectValue]:
-        frame_references = {'frame', self._frame.values} if self._frame.values.has_references(to_check) else {}
+        frame_references = {'frame': self._frame.values} if self._frame.values.has_references(to_check) else {}
         scene_references = {'scene' + str(index): scene.values for index, scene in filter(lambda x: x[1].values.has_references(to_check), enumerate(self.scenes))}
         frame_references.update(scene_references)
 
@@ -324,27 +384,76 @@ class Signage:
         return {'scene{}'.format(index): scene
                 for index, scene in filter(lambda x: x[1].template is to_check, enumerate(self._scenes))}
 
-    def render(self, resource_dir: Path) -> str:
-        # dirs = [str(x.template.root_dir) for x in self._scenes]  # for scene template resources
-        # dirs.append(str(self._frame.template.root_dir))  # for frame template resources
-        dirs = [str(resource_dir)]  # for index.html
-        #
-        # scenes = [str(x.template.root_dir.stem) + '.html' for x in self._scenes]
-        # frame = (str(self._frame.template.root_dir.stem) + '.html')
+    def get_visible_scenes(self, moment: datetime) -> List[Scene]:
+        return [x for x in self._scenes if x.schedule.is_visible(moment)]
+
+    # returns the first moment after the given one when a scene is shown or hidden, or None if it never happens
+    def next_change(self, moment: datetime) -> Optional[datetime]:
+        changes = [x for x in (scene.schedule.next_change(moment) for scene in self._scenes) if x is not None]
+
+        return min(changes) if changes else None
+
+    # returns the rendered frame, scenes visible at the moment, their durations, tags of their resources and the next
+    # change in milliseconds since the epoch. revision is the hash of the others. a screen showing a page of one revision can be patched to another.
+    # parts are cached until the signage is changed, or until a scene is shown or hidden by its schedule.
+    def render_parts(self, moment: datetime=None) -> dict:
+        if moment is None:
+            moment = datetime.now()
+
+        cached = self._parts
+        if cached is not None and cached[0] == self._version and (cached[1] is None or moment < cached[1]):
+            return cached[2]
+
+        # keep the version before rendering. if the signage is changed while rendering, the result is stale.
+        version = self._version
+
+        scenes = self.get_visible_scenes(moment)
+        next_change = self.next_change(moment)
+        durations = [x.duration for x in scenes]
+
+        # styles and scripts of templates are linked once in the head, not in every scene using the template
+        resources = []
+        urls = set()
+
+        def render_template(template: Template, values: ObjectValue) -> str:
+            html, tags = extract_resources(template.render(values.get_values()))
+
+            for url, tag in tags:
+                if url not in urls:
+                    urls.add(url)
+                    # a script in the head runs after the page is parsed, like it did at its place in the body
+                    resources.append(tag.replace('<script', '<script defer', 1) if tag.startswith('<script')
+                                     and ' defer' not in tag else tag)
+
+            return html
+
+        parts = {
+            'frame': render_template(self._frame.template, self._frame.values),
+            'scenes': [render_template(scene.template, scene.values) for scene in scenes],
+            'durations': durations,
+            'resources': resources,
+            'next_change': int(next_change.timestamp() * 1000) if next_change else None
+        }
+        parts['revision'] = hashlib.sha1(json.dumps(parts, sort_keys=True).encode('UTF-8')).hexdigest()[:12]
+        self._parts = (version, next_change, parts)
+
+        return parts
 
-        schedules = [json.dumps(x.schedule.to_dict()) for x in self._scenes]
-        durations = [x.duration for x in self._scenes]
-        #
-        # data = {str(x.template.root_dir.stem): x.values.get_values() for x in self._scenes}
-        # data[str(self._frame.template.root_dir.stem)] = self._frame.values.get_values()
+    # assets are tags of bundled scripts and styles in the head of the page. libraries are loaded from CDNs without them.
+    # the page is cached while its parts are. see render_parts().
+    def render(self, resource_dir: Path, assets: str='', moment: datetime=None) -> str:
+        parts = self.render_parts(moment)
 
-        rendered_frame = self._frame.template.render(self._frame.values.get_values())
-        rendered_scenes = [scene.template.render(scene.values.get_values()) for scene in self._scenes]
+        rendered = self._rendered
+        if rendered is not None and rendered[0] is parts and rendered[1] == resource_dir and rendered[2] == assets:
+            return rendered[3]
 
-        env = Environment(
-            loader=FileSystemLoader(dirs)
-        )
+        template = template_cache.get_template(resource_dir / 'index.html')
 
-        template = env.get_template('index.html')
+        # screens are asked to reload or patch the page when scenes are shown or hidden. see controller.scheduler.
+        page = template.render(_durations=parts['durations'], _scenes=parts['scenes'], _frame=parts['frame'],
+                               _assets=assets, _resources='\n'.join(parts['resources']),
+                               _revision=parts['revision'], _next_change=parts['next_change'])
+        self._rendered = (parts, resource_dir, assets, page)
 
-        return template.render(_schedules=schedules, _durations=durations, _scenes=rendered_scenes, _frame=rendered_frame)
+        return page
@@ -1,10 +1,81 @@
+import re
+import threading
 from pathlib import Path
+from typing import Dict, Tuple, List
 
 from jinja2 import Environment, FileSystemLoader
+from jinja2 import Template as JinjaTemplate
 
 from model.data_type import ObjectDataType
 
 
+class TemplateCache:
+    # process-wide cache of compiled jinja2 templates.
+    # an entry is compiled again when the modification time of its file changes.
+    def __init__(self):
+        self._environments = dict()  # type: Dict[str, Environment]
+        self._templates = dict()  # type: Dict[str, Tuple[int, JinjaTemplate]]
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def get_template(self, template_path: Path) -> JinjaTemplate:
+        key = str(template_path)
+        mtime = template_path.stat().st_mtime_ns
+
+        with self._lock:
+            entry = self._templates.get(key)
+            if entry is not None and entry[0] == mtime:
+                self._hits += 1
+                return entry[1]
+
+            self._misses += 1
+            template = self._get_environment(str(template_path.parent)).get_template(template_path.name)
+            self._templates[key] = (mtime, template)
+
+        return template
+
+    def clear(self) -> None:
+        with self._lock:
+            self._environments = dict()
+            self._templates = dict()
+            self._hits = 0
+            self._misses = 0
+
+    def _get_environment(self, root_dir: str) -> Environment:
+        if root_dir not in self._environments.keys():
+            # compiled templates are kept by this class. disable the cache of jinja2 not to load them twice.
+            self._environments[root_dir] = Environment(loader=FileSystemLoader(root_dir), cache_size=0)
+
+        return self._environments[root_dir]
+
+
+template_cache = TemplateCache()
+
+# <link ... href="..."> or <script ... src="..."></script>
+RESOURCE_TAG = re.compile(r'<link\b[^>]*?\bhref="(?P<href>[^"]+)"[^>]*>|'
+                          r'<script\b[^>]*?\bsrc="(?P<src>[^"]+)"[^>]*>\s*</script>')
+
+
+# removes tags of styles and scripts from a rendered template. returns the html and (url, tag) of the tags.
+def extract_resources(html: str) -> Tuple[str, List[Tuple[str, str]]]:
+    resources = []
+
+    def replace(match):
+        resources.append((match.group('href') or match.group('src'), match.group(0)))
+        return ''
+
+    return RESOURCE_TAG.sub(replace, html), resources
+
+
 class Template:
     def __init__(self, template_id: str, definition: ObjectDataType, path: Path):
         self._id = template_id
@@ -24,11 +95,7 @@ class Template:
         return self._definition
 
     def render(self, data: dict) -> str:
-        env = Environment(
-            loader=FileSystemLoader(str(self._root_dir))
-        )
-
-        template = env.get_template('{}.html'.format(self._id))
+        template = template_cache.get_template(self._root_dir / '{}.html'.format(self._id))
 
         return template.render(x=data)
 
@@ -0,0 +1,89 @@
+import argparse
+import signal
+import sys
+import time
+from pathlib import Path
+
+# serves channels without the gui. run in the src directory:
+#   python server.py --root ../data --host 0.0.0.0 --port 5000 --async-mode eventlet
+# pyqt is not imported, so this runs on a machine without a display.
+# pending changes are written when the process is stopped by SIGTERM or SIGINT.
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='serves channels without the gui')
+    parser.add_argument('--root', type=Path, default=Path('../data'), help='data directory')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--async-mode', default='eventlet', choices=['threading', 'eventlet', 'gevent'])
+    parser.add_argument('--workers', type=int, default=1000, help='number of concurrent green threads')
+    parser.add_argument('--lazy', action='store_true', help='resolve fields of values on their first access, '
+                                                            'instead of on loading')
+    parser.add_argument('--snapshot', action='store_true', help='load the data directory from snapshot files if no '
+                                                                'file is changed since they are written')
+    parser.add_argument('--check', action='store_true', help='load the data directory, print the startup time '
+                                                             'and exit without serving')
+    return parser.parse_args()
+
+
+def main() -> int:
+    started = time.perf_counter()
+    args = parse_args()
+
+    # green threads replace blocking calls of the process. patch before the managers create threads and locks.
+    # files are not green, so reading and writing them is run on a pool of real threads instead.
+    from utils import persistence
+
+    if args.check:
+        pass  # nothing is served
+    elif args.async_mode == 'eventlet':
+        import eventlet
+        import eventlet.tpool
+        eventlet.monkey_patch()
+        persistence.set_blocking_call(eventlet.tpool.execute)
+    elif args.async_mode == 'gevent':
+        import gevent
+        from gevent import monkey
+        monkey.patch_all()
+        persistence.set_blocking_call(lambda function, *x: gevent.get_hub().threadpool.apply(function, x))
+
+    from controller.manager import load_managers
+    from utils import logger
+
+    managers = load_managers(args.root.resolve(), use_snapshot=args.snapshot, lazy_values=args.lazy)
+    loaded = time.perf_counter()
+
+    if args.check:
+        print('startup: {:.3f} s'.format(loaded - started))
+        print('channels: {}'.format(len(managers.chn_mng.channels)))
+
+        try:
+            import resource
+            print('max rss: {} KiB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+        except ImportError:
+            pass  # not on windows
+
+        managers.flush()
+        return 0
+
+    from webserver.web_server import WebServer
+
+    def stop(signum, frame):
+        managers.flush()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info('managers loaded in {:.3f} s'.format(loaded - started))
+
+    server = WebServer(managers.chn_mng, managers.obj_mng, managers.tpl_mng, managers.sgn_mng, managers.mtm_mng,
+                       args.async_mode)
+    server.serve(args.host, args.port, args.workers)
+
+    managers.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
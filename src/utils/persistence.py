@@ -0,0 +1,324 @@
+import atexit
+import json
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Iterator, Sequence, List, Union, Any, KeysView, Tuple, Callable
+
+from utils import logger
+
+SNAPSHOT_VERSION = 2
+
+# runs a function of blocking file I/O. a server of green threads sets a pool of real threads, e.g. eventlet.tpool,
+# so that reading and writing files don't stop the other green threads. see server.py.
+_blocking_call = None  # type: Optional[Callable[..., Any]]
+
+
+def set_blocking_call(blocking_call: Optional[Callable[..., Any]]) -> None:
+    global _blocking_call
+    _blocking_call = blocking_call
+
+
+def call_blocking(function: Callable[..., Any], *args) -> Any:
+    return function(*args) if _blocking_call is None else _blocking_call(function, *args)
+
+
+def read_json_file(path: Path) -> dict:
+    with path.open(encoding='UTF-8') as f:
+        return json.load(f)
+
+
+def _read_json_chunk(paths: Sequence[Path]) -> List[dict]:
+    return [read_json_file(x) for x in paths]
+
+
+# reads files on a thread pool, and yields their contents in the order of the paths.
+# reading is I/O bound, so files are opened while the caller builds objects from the previous ones.
+# files are handed to the threads in chunks not to create a task for every small file.
+# threads of the pool would be green threads in a server of green threads, so the chunks are read by call_blocking.
+def read_json_files(paths: Sequence[Path], max_workers: int=8, chunk_size: int=64) -> Iterator[dict]:
+    if max_workers <= 1:
+        yield from map(read_json_file, paths)
+        return
+
+    chunks = [paths[x:x + chunk_size] for x in range(0, len(paths), chunk_size)]
+
+    if _blocking_call is not None:
+        for chunk in chunks:
+            yield from call_blocking(_read_json_chunk, chunk)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for contents in executor.map(_read_json_chunk, chunks):
+            yield from contents
+
+
+def write_atomic(path: Path, content: Union[str, bytes]) -> int:
+    # write to a temporary file in the same directory and rename it.
+    # a reader never sees a partially written file, even when the process dies while writing.
+    data = content.encode('UTF-8') if isinstance(content, str) else content
+    temp_path = path.with_name('.{}.tmp'.format(path.name))
+
+    try:
+        with temp_path.open('wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(str(temp_path), str(path))
+    except BaseException:
+        if temp_path.exists():
+            os.remove(str(temp_path))
+        raise
+
+    return len(data)
+
+
+# writes files like write_atomic. renames are synced to the disk once per directory instead of once per file.
+# returns the number of files and bytes written, and errors of files which are not written by their paths.
+def write_atomic_files(contents: Dict[Path, Union[str, bytes]]) -> Tuple[int, int, Dict[Path, Exception]]:
+    writes = 0
+    bytes_written = 0
+    errors = dict()
+    directories = set()
+
+    for path, content in contents.items():
+        try:
+            bytes_written += write_atomic(path, content)
+            writes += 1
+            directories.add(path.parent)
+        except Exception as e:
+            errors[path] = e
+
+    for directory in directories:
+        _fsync_directory(directory)
+
+    return writes, bytes_written, errors
+
+
+def _fsync_directory(path: Path) -> None:
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return  # a directory can't be opened on windows
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# modification times and sizes of files in a directory, and in its sub directories if include_sub_dirs.
+# a file edited in place, e.g. by hand or by rsync, changes its entry. a file added or removed changes the keys.
+def get_directory_fingerprint(root_dir: Path, include_sub_dirs: bool=False) -> Dict[str, List[int]]:
+    fingerprint = dict()
+    sub_dirs = []
+
+    for entry in os.scandir(str(root_dir)):
+        if entry.is_dir():
+            sub_dirs.append(entry)
+        else:
+            stat = entry.stat()
+            fingerprint[entry.name] = [stat.st_mtime_ns, stat.st_size]
+
+    if include_sub_dirs:
+        for sub_dir in sub_dirs:
+            for entry in os.scandir(sub_dir.path):
+                if not entry.is_dir():
+                    stat = entry.stat()
+                    fingerprint['{}/{}'.format(sub_dir.name, entry.name)] = [stat.st_mtime_ns, stat.st_size]
+
+    return fingerprint
+
+
+class Snapshot:
+    # entities packed in a single snapshot file. an entity is decoded when it is accessed.
+    def __init__(self, data: bytes, body_offset: int, index: Dict[str, List[int]]):
+        self._data = data
+        self._body_offset = body_offset
+        self._index = index
+
+    def keys(self) -> KeysView[str]:
+        return self._index.keys()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __getitem__(self, key: str) -> Any:
+        offset, length = self._index[key]
+        start = self._body_offset + offset
+
+        return json.loads(self._data[start:start + length].decode('UTF-8'))
+
+
+# snapshot file: a header line with the fingerprint of the data directory and an index of (offset, length),
+# followed by JSON documents of the entities.
+def write_snapshot(path: Path, fingerprint: Dict[str, int], entities: Dict[str, Any]) -> int:
+    index = dict()
+    body = []
+    offset = 0
+
+    for key, entity in entities.items():
+        data = json.dumps(entity).encode('UTF-8')
+        index[key] = [offset, len(data)]
+        body.append(data)
+        offset += len(data)
+
+    header = json.dumps({'version': SNAPSHOT_VERSION, 'fingerprint': fingerprint, 'index': index}).encode('UTF-8')
+
+    return write_atomic(path, b''.join([header, b'\n'] + body))
+
+
+# returns None if there is no snapshot or the data directory is changed after the snapshot is written
+def read_snapshot(path: Path, fingerprint: Dict[str, int]) -> Optional[Snapshot]:
+    try:
+        with path.open('rb') as f:
+            data = f.read()
+
+        header_end = data.index(b'\n')
+        header = json.loads(data[:header_end].decode('UTF-8'))
+    except (OSError, ValueError):
+        return None
+
+    if header.get('version') != SNAPSHOT_VERSION or header.get('fingerprint') != fingerprint:
+        return None
+
+    return Snapshot(data, header_end + 1, header['index'])
+
+
+# writers having pending files are flushed on exit. a writer is not kept alive for it.
+_writers = weakref.WeakSet()
+
+
+def _flush_writers() -> None:
+    for writer in list(_writers):
+        try:
+            writer.flush()
+        except Exception:
+            pass  # logged by the writer
+
+
+atexit.register(_flush_writers)
+
+
+class WriteBehindWriter:
+    # collects files to write and writes them on a background thread.
+    # repeated writes of the same file within the delay are coalesced into a single write of the last content.
+    # the content is serialized by the caller when scheduling. objects are changed on other threads, so they are not
+    # read on the writer thread.
+    # a file which fails to be written, e.g. on a full disk, is written again after retry_delay.
+    retry_delay = 5  # seconds
+
+    def __init__(self, delay: float=0.5):
+        self._delay = delay
+        self._pending = dict()  # type: Dict[Path, str]
+        self._deadline = None  # type: Optional[float]
+
+        self._condition = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._thread = None
+
+        self._writes = 0
+        self._bytes_written = 0
+
+        _writers.add(self)
+        # wakes the thread to end it when the writer is collected
+        weakref.finalize(self, WriteBehindWriter._notify, self._condition)
+
+    @property
+    def writes(self) -> int:
+        return self._writes
+
+    @property
+    def bytes_written(self) -> int:
+        return self._bytes_written
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def schedule(self, path: Path, content: str) -> None:
+        with self._condition:
+            self._pending[path] = content
+
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self._delay
+                self._condition.notify()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=WriteBehindWriter._run, args=(weakref.ref(self), self._condition),
+                                                daemon=True)
+                self._thread.start()
+
+    def delete(self, path: Path) -> None:
+        # a pending write should be dropped. if not, the deleted file would be created again.
+        with self._io_lock:
+            with self._condition:
+                self._pending.pop(path, None)
+
+            if path.exists():
+                os.remove(str(path))
+
+    # every error is logged, and the first one is raised
+    def flush(self) -> None:
+        with self._io_lock:
+            with self._condition:
+                contents = self._pending
+                self._pending = dict()
+                self._deadline = None
+                self._condition.notify()  # the thread waits for nothing
+
+            writes, bytes_written, errors = call_blocking(write_atomic_files, contents)
+            self._writes += writes
+            self._bytes_written += bytes_written
+
+            if not errors:
+                return
+
+            with self._condition:
+                # the content is kept unless a newer one is scheduled meanwhile
+                for path in errors.keys():
+                    self._pending.setdefault(path, contents[path])
+
+                if self._deadline is None:
+                    self._deadline = time.monotonic() + self.retry_delay
+                    self._condition.notify()
+
+            for path, error in errors.items():
+                logger.error('failed to write {}: {}'.format(path, error))
+
+            raise next(iter(errors.values()))
+
+    @staticmethod
+    def _notify(condition: threading.Condition) -> None:
+        with condition:
+            condition.notify()
+
+    # the thread holds the writer only while files are pending, so an idle writer can be collected
+    @staticmethod
+    def _run(writer_ref: 'weakref.ref', condition: threading.Condition) -> None:
+        while True:
+            with condition:
+                writer = writer_ref()
+                if writer is None:
+                    return
+
+                if writer._deadline is None:
+                    del writer
+                    condition.wait()
+                    continue
+
+                timeout = writer._deadline - time.monotonic()
+                if timeout > 0:
+                    condition.wait(timeout)  # pending files are written before the writer is collected
+                    continue
+
+            try:
+                writer.flush()
+            except Exception:
+                pass  # logged by flush(). failed files are written again later.
+
+            del writer
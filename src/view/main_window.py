@@ -6,7 +6,7 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget,
 from webserver.web_server import WebServer
 from controller.manager import (ObjectManager, TemplateManager,
                                 SignageManager, MultimediaManager,
-                                ChannelManager)
+                                ChannelManager, load_managers)
 from view.resource_manager import ResourceManager
 from view.main_tab_widget import MainTabWidget
 
@@ -86,16 +86,8 @@ class MainWindow(QMainWindow):
 
         self._root_path = root_path.resolve()
 
-        self._mtm_mng = MultimediaManager(root_path / 'media')
-        self._obj_mng = ObjectManager(self._root_path / 'data', self._mtm_mng)
-        self._tpl_mng = TemplateManager(self._root_path / 'template', self._obj_mng)
-        self._sgn_mng = SignageManager(self._root_path / 'signage', self._obj_mng, self._tpl_mng)
-        self._chn_mng = ChannelManager(self._root_path / 'channel', self._sgn_mng)
-
-        self._mtm_mng.bind_managers(self._sgn_mng, self._obj_mng)
-        self._obj_mng.bind_managers(self._tpl_mng, self._sgn_mng)
-        self._tpl_mng.bind_managers(self._sgn_mng)
-        self._sgn_mng.bind_managers(self._chn_mng)
+        self._managers = load_managers(self._root_path, use_snapshot=True)
+        self._mtm_mng, self._obj_mng, self._tpl_mng, self._sgn_mng, self._chn_mng = self._managers
 
         self._res = ResourceManager()
         self.init_ui()
@@ -108,6 +100,12 @@ class MainWindow(QMainWindow):
         self.setWindowTitle(self._res['mainWindowTitle'])
         self.show()
 
+    def closeEvent(self, event):
+        # write pending changes before the window is closed
+        self._managers.flush()
+
+        super().closeEvent(event)
+
 
 if __name__ == '__main__':
     app = QApplication(sys. argv)
@@ -0,0 +1,330 @@
+import argparse
+import hashlib
+import json
+import re
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List, Tuple, Set, Optional
+
+from controller.manager import TemplateManager
+from model.template import RESOURCE_TAG
+from utils import logger
+from utils.persistence import get_directory_fingerprint, write_atomic
+
+# bundles scripts and styles of a signage page, so a screen loads a few cached files instead of every file of
+# every template and libraries from public CDNs.
+# styles of every template are bundled together. scripts of templates are bundled for each page from the templates
+# it uses, since a script may expect elements of its template, e.g. current_time.js of bottom_clock.
+#
+# libraries are listed in signage/vendor/manifest.json and stored in the same directory. the server downloads
+# missing ones when it starts. to download them on installation instead:
+#   python -m webserver.asset_pipeline fetch --root ../data
+# if a library is not downloaded, it is loaded from its url.
+
+VENDOR_DIR = 'vendor'
+
+# libraries of the signage page. used if a data directory has no manifest.
+DEFAULT_VENDOR_MANIFEST = {
+    'styles': [
+        {'file': 'slick.css', 'url': 'https://cdn.jsdelivr.net/jquery.slick/1.6.0/slick.css'}
+    ],
+    'scripts': [
+        {'file': 'jquery.min.js', 'url': 'https://code.jquery.com/jquery-1.11.0.min.js'},
+        {'file': 'jquery-migrate.min.js', 'url': 'https://code.jquery.com/jquery-migrate-1.2.1.min.js'},
+        {'file': 'socket.io.min.js', 'url': 'https://cdnjs.cloudflare.com/ajax/libs/socket.io/1.3.6/socket.io.min.js'},
+        {'file': 'slick.min.js', 'url': 'https://cdn.jsdelivr.net/jquery.slick/1.6.0/slick.min.js'}
+    ]
+}
+
+_CSS_TOKEN = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/|\s*([{};,>])\s*|(:)\s+|\s+', re.S)
+
+
+def minify_css(text: str) -> str:
+    def replace(match):
+        if match.group(1):
+            return match.group(1)  # strings are kept as they are
+        elif match.group(2):
+            return match.group(2)
+        elif match.group(3):
+            return match.group(3)
+        elif match.group(0).startswith('/*'):
+            return ''
+
+        return ' '
+
+    return _CSS_TOKEN.sub(replace, text).strip()
+
+
+# only whitespace at the start and the end of lines is removed. removing comments needs a parser of javascript.
+def minify_js(text: str) -> str:
+    if '`' in text:
+        return text  # a template literal may span lines
+
+    return '\n'.join(x.strip() for x in text.splitlines() if x.strip())
+
+
+def get_resource_urls(html: str) -> List[str]:
+    return [x.group('href') or x.group('src') for x in RESOURCE_TAG.finditer(html)]
+
+
+def read_vendor_manifest(signage_dir: Path) -> dict:
+    manifest_path = signage_dir / VENDOR_DIR / 'manifest.json'
+    if not manifest_path.exists():
+        return DEFAULT_VENDOR_MANIFEST
+
+    with manifest_path.open(encoding='UTF-8') as f:
+        return json.load(f)
+
+
+class Bundle:
+    def __init__(self, name: str, content: bytes):
+        stem, suffix = name.split('.')
+        self._hash = hashlib.sha1(content).hexdigest()[:12]
+        self._name = '{}.{}.{}'.format(stem, self._hash, suffix)
+        self._content = content
+
+    @property
+    def name(self) -> str:
+        return self._name  # e.g. templates.0123456789ab.css
+
+    @property
+    def hash(self) -> str:
+        return self._hash
+
+    @property
+    def content(self) -> bytes:
+        return self._content
+
+
+class AssetPipeline:
+    url_prefix = '/_/bundle/'
+    check_interval = 2  # seconds. files of templates and libraries are checked for changes at most this often
+
+    def __init__(self, signage_dir: Path, tpl_mng: TemplateManager):
+        self._signage_dir = signage_dir
+        self._tpl_mng = tpl_mng
+        self._bundles = dict()  # type: Dict[str, Bundle]
+        self._bundled_urls = frozenset()  # type: Set[str]
+        self._template_scripts = dict()  # type: Dict[str, str]  # url -> minified script
+        self._script_bundles = dict()  # type: Dict[Tuple[str, ...], Bundle]  # urls of scripts in a page -> bundle
+        self._head_tags = ''
+        self._version = 0
+        self._sources = None  # fingerprint of the files bundles are built from
+        self._checked = 0.0
+
+    @property
+    def head_tags(self) -> str:
+        return self._head_tags
+
+    @property
+    def bundled_urls(self) -> Set[str]:
+        return self._bundled_urls
+
+    @property
+    def version(self) -> int:
+        return self._version  # increased on every build. a page stripped before may refer to a removed bundle.
+
+    def get_bundle(self, name: str) -> Optional[Bundle]:
+        return self._bundles.get(name)
+
+    # gathers files of libraries and templates, and builds bundles of them.
+    # see refresh() to build them again when a file is changed.
+    def build(self) -> None:
+        sources = self._get_sources()
+        bundles = []
+        head_tags = []
+
+        vendor_styles, vendor_scripts = self._read_vendor()
+        template_styles, bundled_urls, template_scripts = self._read_templates()
+
+        for name, files, minify in [('vendor.css', vendor_styles, minify_css),
+                                    ('templates.css', template_styles, minify_css)]:
+            if files:
+                bundle = Bundle(name, '\n'.join(minify(x) for x in files).encode('UTF-8'))
+                bundles.append(bundle)
+                head_tags.append('<link rel="stylesheet" type="text/css" href="{}{}"/>'.format(self.url_prefix,
+                                                                                             bundle.name))
+
+        if vendor_scripts:
+            bundle = self._build_scripts('vendor.js', [minify_js(x) for x in vendor_scripts])
+            bundles.append(bundle)
+            head_tags.append('<script type="text/javascript" src="{}{}"></script>'.format(self.url_prefix, bundle.name))
+
+        # bundles of pages served before are kept, so their screens can still load them
+        template_scripts = {x: minify_js(y) for x, y in template_scripts.items()}
+        script_bundles = {x: self._build_scripts('templates.js', [template_scripts[y] for y in x])
+                          for x in self._script_bundles.keys() if all(y in template_scripts for y in x)}
+        bundles.extend(script_bundles.values())
+
+        if vendor_styles is None:
+            head_tags = self._get_vendor_fallback_tags() + head_tags
+
+        self._bundles = {x.name: x for x in bundles}
+        self._bundled_urls = frozenset(bundled_urls)
+        self._template_scripts = template_scripts
+        self._script_bundles = script_bundles
+        self._head_tags = '\n'.join(head_tags)
+        self._sources = sources
+        self._checked = time.monotonic()
+        self._version += 1
+
+        logger.info('asset bundles built: {}'.format(', '.join(self._bundles.keys())))
+
+    # builds bundles again if a template or a library is added or changed, and returns whether they are built.
+    # bundles are cached by browsers forever, so a changed file gets a bundle of a new name.
+    def refresh(self) -> bool:
+        if time.monotonic() - self._checked < self.check_interval:
+            return False
+
+        self._checked = time.monotonic()
+        if self._get_sources() == self._sources:
+            return False
+
+        self.build()
+        return True
+
+    # downloads libraries which are not in the vendor directory, and builds bundles with them.
+    # libraries which can't be downloaded are loaded from their urls.
+    def download_vendor(self) -> None:
+        try:
+            count = fetch_vendor(self._signage_dir)
+        except OSError as e:
+            logger.warn('failed to download libraries: {}'.format(e))
+            return
+
+        if count:
+            self.build()
+
+    # removes tags of files in a bundle from a rendered page.
+    # scripts of templates are replaced by a bundle of them at the first of their tags, in the order of the page.
+    def strip_bundled(self, page: str) -> str:
+        bundled_urls = self._bundled_urls
+        template_scripts = self._template_scripts
+        script_urls = tuple(dict.fromkeys(x for x in get_resource_urls(page) if x in template_scripts))
+        script_tag = ''
+
+        if script_urls:
+            bundle = self._script_bundles.get(script_urls)
+            if bundle is None:
+                bundle = self._build_scripts('templates.js', [template_scripts[x] for x in script_urls])
+                self._bundles[bundle.name] = bundle
+                self._script_bundles[script_urls] = bundle
+
+            script_tag = '<script type="text/javascript" src="{}{}" defer></script>'.format(self.url_prefix,
+                                                                                           bundle.name)
+
+        def replace(match):
+            nonlocal script_tag
+            url = match.group('href') or match.group('src')
+
+            if url in bundled_urls:
+                return ''
+            elif url in template_scripts:
+                tag, script_tag = script_tag, ''
+                return tag
+
+            return match.group(0)
+
+        return RESOURCE_TAG.sub(replace, page)
+
+    # scripts are minified. a file may not end with a semicolon.
+    @staticmethod
+    def _build_scripts(name: str, scripts: List[str]) -> Bundle:
+        return Bundle(name, ';\n'.join(scripts).encode('UTF-8'))
+
+    def _get_sources(self) -> Dict[str, dict]:
+        directories = [self._signage_dir / VENDOR_DIR] + \
+                      [x.root_dir for x in self._tpl_mng.frame_templates.values()] + \
+                      [x.root_dir for x in self._tpl_mng.scene_templates.values()]
+
+        return {str(x): get_directory_fingerprint(x) if x.is_dir() else {} for x in directories}
+
+    # returns None if a library is not downloaded
+    def _read_vendor(self) -> Tuple[Optional[List[str]], Optional[List[str]]]:
+        manifest = read_vendor_manifest(self._signage_dir)
+        vendor_dir = self._signage_dir / VENDOR_DIR
+        files = manifest['styles'] + manifest['scripts']
+
+        missing = [x['file'] for x in files if not (vendor_dir / x['file']).exists()]
+        if missing:
+            logger.warn('libraries are loaded from CDNs. not downloaded: {}'.format(', '.join(missing)))
+            return None, None
+
+        return ([(vendor_dir / x['file']).read_text(encoding='UTF-8') for x in manifest['styles']],
+                [(vendor_dir / x['file']).read_text(encoding='UTF-8') for x in manifest['scripts']])
+
+    def _get_vendor_fallback_tags(self) -> List[str]:
+        manifest = read_vendor_manifest(self._signage_dir)
+
+        return ['<link rel="stylesheet" type="text/css" href="{}"/>'.format(x['url']) for x in manifest['styles']] + \
+               ['<script type="text/javascript" src="{}"></script>'.format(x['url']) for x in manifest['scripts']]
+
+    # styles and scripts referenced by html files of templates. styles in the order of templates, their urls, and
+    # scripts by their urls.
+    def _read_templates(self) -> Tuple[List[str], Set[str], Dict[str, str]]:
+        styles = []
+        style_urls = set()
+        scripts = dict()
+
+        templates = [('frame', x) for _, x in sorted(self._tpl_mng.frame_templates.items())] + \
+                    [('scene', x) for _, x in sorted(self._tpl_mng.scene_templates.items())]
+
+        for category, template in templates:
+            html = (template.root_dir / '{}.html'.format(template.id)).read_text(encoding='UTF-8')
+
+            for url in get_resource_urls(html):
+                prefix = '/_/{}/{}/'.format(category, template.id)
+                file_name = url[len(prefix):]
+
+                if not url.startswith(prefix) or '/' in file_name or url in style_urls or url in scripts:
+                    continue
+
+                file_path = template.root_dir / file_name
+                if file_path.suffix not in ('.css', '.js') or not file_path.exists():
+                    continue
+
+                if file_path.suffix == '.css':
+                    styles.append(file_path.read_text(encoding='UTF-8'))
+                    style_urls.add(url)
+                else:
+                    scripts[url] = file_path.read_text(encoding='UTF-8')
+
+        return styles, style_urls, scripts
+
+
+def fetch_vendor(signage_dir: Path, timeout: float=10) -> int:
+    manifest = read_vendor_manifest(signage_dir)
+    vendor_dir = signage_dir / VENDOR_DIR
+    vendor_dir.mkdir(exist_ok=True)
+
+    count = 0
+
+    for entry in manifest['styles'] + manifest['scripts']:
+        file_path = vendor_dir / entry['file']
+        if file_path.exists():
+            continue
+
+        # a broken download is not left as a library
+        with urllib.request.urlopen(entry['url'], timeout=timeout) as response:
+            write_atomic(file_path, response.read())
+
+        logger.info('{} <- {}'.format(file_path, entry['url']))
+        count += 1
+
+    return count
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='downloads libraries of signage pages')
+    parser.add_argument('command', choices=['fetch'])
+    parser.add_argument('--root', type=Path, default=Path('../data'), help='data directory')
+    args = parser.parse_args()
+
+    print('downloaded: {}'.format(fetch_vendor(args.root / 'signage')))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
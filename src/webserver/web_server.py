@@ -1,16 +1,63 @@
+import hashlib
+import io
+import mimetypes
 import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterator, Tuple, Optional
 
 import flask
 import flask_socketio
 
+from controller import catalogue_sync
 from controller.manager import ObjectManager, TemplateManager, SignageManager, ChannelManager, MultimediaManager
+from controller.scheduler import ScheduleWatcher
 from model.channel import Channel
 from utils import logger
+from webserver.asset_pipeline import AssetPipeline
+
+
+# returns an update which patches a page of the old parts to the new ones, or None if the page should be reloaded.
+# only changed parts are in the update. scenes are compared by their index.
+def get_update(old_parts: dict, new_parts: dict) -> Optional[dict]:
+    if not set(new_parts['resources']) <= set(old_parts['resources']):
+        return None  # a new template needs files which are not in the page
+
+    update = {'from': old_parts['revision'], 'to': new_parts['revision']}
+
+    if new_parts['frame'] != old_parts['frame']:
+        update['frame'] = new_parts['frame']
+
+    old_scenes = old_parts['scenes']
+    new_scenes = new_parts['scenes']
+    scenes = {str(index): scene for index, scene in enumerate(new_scenes)
+              if index >= len(old_scenes) or scene != old_scenes[index]}
+
+    if scenes or len(new_scenes) != len(old_scenes):
+        update['scenes'] = scenes
+        update['scene_count'] = len(new_scenes)
+
+    if new_parts['durations'] != old_parts['durations']:
+        update['durations'] = new_parts['durations']
+
+    if new_parts['next_change'] != old_parts['next_change']:
+        update['next_change'] = new_parts['next_change']
+
+    return update
 
 
 class WebServer:
+    # seconds a browser may use a file without asking the server again.
+    # channel pages are always revalidated, so a change of a signage is shown on the next reload.
+    template_max_age = 60
+    media_max_age = 3600
+    stream_chunk_size = 64 * 1024  # bytes read at once while a range of a video is sent
+    update_delay = 0.1  # seconds. changes made together, e.g. by a bulk import, are sent in one update
+    # async_mode is 'threading' for the development server run by the gui.
+    # 'eventlet' or 'gevent' serve http routes and socket.io connections on green threads. the process should be
+    # monkey patched by the library before other modules are imported. see serve().
     def __init__(self, chn_mng: ChannelManager, obj_mng: ObjectManager, tpl_mng: TemplateManager,
-                 sgn_mng: SignageManager, mtm_mng: MultimediaManager):
+                 sgn_mng: SignageManager, mtm_mng: MultimediaManager, async_mode: str='threading'):
         self._app = flask.Flask(__name__)
         self._app.static_folder = str(tpl_mng.root_dir.resolve())
         self._app.add_url_rule('/favicon.ico', 'favicon', lambda: '')
@@ -18,6 +65,8 @@ class WebServer:
         self._app.add_url_rule('/<channel_id>', 'handle_channel', self.handle_channel)
         self._app.add_url_rule('/_/image/<file_name>', 'handle_image_static', self.handle_image_static)
         self._app.add_url_rule('/_/video/<file_name>', 'handle_video_static', self.handle_video_static)
+        self._app.add_url_rule('/_/bundle/<name>', 'handle_bundle', self.handle_bundle)
+        self._app.add_url_rule('/_/sync/<type_id>', 'handle_sync', self.handle_sync, methods=['POST'])
         self._app.add_url_rule('/_/<path:path>', 'handle_template_static', self.handle_template_static)
 
         self._chn_mng = chn_mng
@@ -25,44 +74,282 @@ class WebServer:
         self._tpl_mng = tpl_mng
         self._sgn_mng = sgn_mng
         self._mtm_mng = mtm_mng
+        self._pages = dict()  # channel id -> (rendered page, version of bundles, served page, etag)
+        self._sent_parts = dict()  # channel id -> parts of the page last served or patched on screens
+        self._pending_updates = set()  # channel ids
+        self._update_lock = threading.Lock()  # guards pending updates and sent parts
+
+        # scripts and styles of pages are bundled on start, and again when a file of them is changed
+        self._asset_pipeline = AssetPipeline(sgn_mng.root_dir, tpl_mng)
+        self._asset_pipeline.build()
 
-        self._socket_io = flask_socketio.SocketIO(self._app, ping_interval=10, ping_timeout=60)
+        self._async_mode = async_mode
+        self._socket_io = flask_socketio.SocketIO(self._app, ping_interval=10, ping_timeout=60, async_mode=async_mode)
         self._io_server = FlaskIOServer(self._socket_io)
 
+        # a renamed channel is reloaded on its new url. screens of a changed channel are patched.
         def redirect_event(channel: Channel, old_id: str):
-            self._io_server.request_redirect(old_id, channel.id)
+            if old_id != channel.id:
+                with self._update_lock:
+                    self._sent_parts.pop(old_id, None)
+                self._io_server.request_redirect(old_id, channel.id)
+            else:
+                self._request_update(channel.id)
 
         def count_event(channel: Channel):
             return self._io_server.get_connections(channel.id)
 
+        # a screen connected again may have missed updates
+        def revision_event(channel_id: str):
+            try:
+                return self._chn_mng.get_channel(channel_id).signage.render_parts()['revision']
+            except KeyError:
+                return None
+
         self._chn_mng.redirect_event_handler = redirect_event
         self._chn_mng.count_event_handler = count_event
+        self._io_server.revision_event_handler = revision_event
 
         self._socket_io.on_namespace(self._io_server)
 
+        # screens of a channel reload when a scene of its signage is shown or hidden by its schedule
+        self._schedule_watcher = ScheduleWatcher(sgn_mng, chn_mng)
+
         super().__init__()
 
-    def start(self):
-        threading.Thread(target=lambda: self._socket_io.run(self._app)).start()
+    @property
+    def app(self) -> flask.Flask:
+        return self._app
+
+    @property
+    def socket_io(self) -> flask_socketio.SocketIO:
+        return self._socket_io
+
+    @property
+    def asset_pipeline(self) -> AssetPipeline:
+        return self._asset_pipeline
+
+    @property
+    def async_mode(self) -> str:
+        return self._async_mode
+
+    @property
+    def schedule_watcher(self) -> ScheduleWatcher:
+        return self._schedule_watcher
+
+    # runs the development server on a background thread
+    def start(self, host: str='127.0.0.1', port: int=5000):
+        self._schedule_watcher.start()
+        threading.Thread(target=self._asset_pipeline.download_vendor, daemon=True).start()
+        threading.Thread(target=lambda: self._socket_io.run(self._app, host, port)).start()
         logger.info('server started!')
 
+    # runs the server on the calling thread until it is stopped.
+    # with eventlet or gevent, workers is the maximum number of requests and socket.io connections handled
+    # concurrently by green threads. every worker shares the managers of this process.
+    def serve(self, host: str='0.0.0.0', port: int=5000, workers: int=1000):
+        if self._async_mode == 'eventlet':
+            options = {'max_size': workers}
+        elif self._async_mode == 'gevent':
+            options = {'spawn': workers}  # a pool of the size
+        else:
+            options = {}
+
+        threading.Thread(target=self._asset_pipeline.download_vendor, daemon=True).start()
+
+        logger.info('server started on {}:{} ({}, {} workers)'.format(host, port, self._async_mode, workers))
+        self._schedule_watcher.start()
+        try:
+            self._socket_io.run(self._app, host, port, **options)
+        finally:
+            self._schedule_watcher.stop()
+
     def stop(self):
+        self._schedule_watcher.stop()
         self._socket_io.stop()
 
     def handle_channel_list(self) -> str:
         return ' '.join(['<a href="/{0}">{0}</a>'.format(str(x)) for x in self._chn_mng.channels.keys()])
 
-    def handle_channel(self, channel_id: str) -> str:
-        return self._chn_mng.get_channel(channel_id).signage.render(self._sgn_mng.root_dir)
+    def handle_channel(self, channel_id: str) -> flask.Response:
+        self._asset_pipeline.refresh()
+
+        signage = self._chn_mng.get_channel(channel_id).signage
+        moment = datetime.now()
+        rendered = signage.render(self._sgn_mng.root_dir, self._asset_pipeline.head_tags, moment)
+        page, etag = self._get_page(channel_id, rendered)
+        parts = signage.render_parts(moment)
+        with self._update_lock:
+            self._sent_parts[channel_id] = parts
+
+        response = flask.make_response(page)
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+
+        # 304 if the page is not changed since the screen loaded it
+        return response.make_conditional(flask.request)
+
+    # pages are cached by signages until they change. process a page once, not on every request.
+    # files in bundles are removed from the page, and the page is hashed. the hash of the content is used instead of
+    # the version of a signage, which starts again from 0 on restart.
+    def _get_page(self, channel_id: str, rendered: str) -> Tuple[str, str]:
+        version = self._asset_pipeline.version
+        cached = self._pages.get(channel_id)
+        if cached is not None and cached[0] is rendered and cached[1] == version:
+            return cached[2], cached[3]
+
+        page = self._asset_pipeline.strip_bundled(rendered)
+        etag = hashlib.sha1(page.encode('UTF-8')).hexdigest()
+        self._pages[channel_id] = (rendered, version, page, etag)
+
+        return page, etag
+
+    # changes are sent by a background task after update_delay, so a channel changed many times is sent once
+    def _request_update(self, channel_id: str) -> None:
+        with self._update_lock:
+            started = bool(self._pending_updates)
+            self._pending_updates.add(channel_id)
+
+        if not started:
+            self._socket_io.start_background_task(self._send_updates)
+
+    def _send_updates(self) -> None:
+        self._socket_io.sleep(self.update_delay)
 
-    def handle_template_static(self, path: str) -> str:
-        return self._app.send_static_file(path)
+        with self._update_lock:
+            channel_ids, self._pending_updates = self._pending_updates, set()
 
-    def handle_image_static(self, file_name: str) -> int:
-        return flask.send_from_directory(self._mtm_mng.image_type.root_dir, file_name)
+        for channel_id in channel_ids:
+            try:
+                self._send_update(channel_id)
+            except Exception as e:
+                logger.error('failed to update {} channel: {}'.format(channel_id, e))
 
-    def handle_video_static(self, file_name: str) -> int:
-        return flask.send_from_directory(self._mtm_mng.video_type.root_dir, file_name)
+    def _send_update(self, channel_id: str) -> None:
+        if self._io_server.get_connections(channel_id) == 0:
+            return  # no screen to update. a screen loading the page later gets the new one.
+
+        try:
+            new_parts = self._chn_mng.get_channel(channel_id).signage.render_parts()
+        except KeyError:
+            return  # removed
+
+        # sent parts are read and replaced at once. a request serving the page may write them meanwhile.
+        with self._update_lock:
+            old_parts = self._sent_parts.get(channel_id)
+            update = get_update(old_parts, new_parts) if old_parts is not None else None
+            self._sent_parts[channel_id] = new_parts
+
+        if update is None:
+            self._io_server.request_redirect(channel_id, channel_id)  # screens reload the whole page
+        elif update['from'] != update['to']:
+            self._io_server.request_update(channel_id, update)
+
+    # values of a type are synced from the body of a request. see controller.catalogue_sync.
+    # changes are made on the values in memory, so screens are updated and nothing is overwritten by stale values.
+    # only requests from this machine are allowed.
+    def handle_sync(self, type_id: str) -> flask.Response:
+        if flask.request.remote_addr not in ('127.0.0.1', '::1'):
+            flask.abort(403)
+
+        try:
+            type_instance = self._obj_mng.get_object_type(type_id)
+        except KeyError:
+            flask.abort(404)
+
+        file_format = flask.request.args.get('format', 'jsonl')
+        if file_format not in catalogue_sync.FORMATS:
+            flask.abort(400)
+
+        stream = io.StringIO(flask.request.get_data(as_text=True), newline='')
+        records = catalogue_sync.read_records(stream, file_format, type_instance)
+        try:
+            summary = catalogue_sync.sync(self._obj_mng, type_instance, records,
+                                          flask.request.args.get('id_key', 'id'),
+                                          flask.request.args.get('delete_missing') == '1')
+        except ValueError:
+            flask.abort(400)  # a broken line. records before it are synced.
+
+        return flask.jsonify(summary._asdict())
+
+    # bundles are named by the hash of their content. a changed bundle has a new url, so it is cached for a year.
+    def handle_bundle(self, name: str) -> flask.Response:
+        bundle = self._asset_pipeline.get_bundle(name)
+        if bundle is None:
+            flask.abort(404)
+
+        response = flask.Response(bundle.content, mimetype=mimetypes.guess_type(name)[0])
+        response.set_etag(bundle.hash)
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(365 * 24 * 3600)
+
+        return response.make_conditional(flask.request)
+
+    def handle_template_static(self, path: str) -> flask.Response:
+        return self._send_file(self._app.static_folder, path, self.template_max_age)
+
+    def handle_image_static(self, file_name: str) -> flask.Response:
+        return self._send_file(self._mtm_mng.image_type.root_dir, file_name, self.media_max_age)
+
+    # screens request ranges of a video to start playing it before it is downloaded, and to seek.
+    # a range is read and sent in chunks, so a large video is never loaded into memory.
+    def handle_video_static(self, file_name: str) -> flask.Response:
+        try:
+            video_path = self._mtm_mng.get_video(file_name).file_path
+            stat = video_path.stat()
+        except (KeyError, AttributeError, OSError):
+            flask.abort(404)
+
+        etag = '{:x}-{:x}'.format(stat.st_mtime_ns, stat.st_size)
+        byte_range = flask.request.range
+        if_range = flask.request.headers.get('If-Range')
+
+        # a whole file is sent if a request has no single range, or it asks for an older version of the file.
+        # ranges are handled here, not by send_file, so both responses have the same etag.
+        if byte_range is None or len(byte_range.ranges) != 1 or (if_range and if_range.strip('"') != etag):
+            response = flask.send_from_directory(str(self._mtm_mng.video_type.root_dir), file_name, conditional=False)
+        else:
+            content_range = byte_range.range_for_length(stat.st_size)
+            if content_range is None:
+                response = flask.Response(status=416)
+                response.headers['Content-Range'] = 'bytes */{}'.format(stat.st_size)
+
+                return response
+
+            start, stop = content_range
+            response = flask.Response(self._read_range(video_path, start, stop), 206, direct_passthrough=True,
+                                      mimetype=mimetypes.guess_type(file_name)[0] or 'application/octet-stream')
+            response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, stop - 1, stat.st_size)
+            response.headers['Content-Length'] = str(stop - start)
+
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.media_max_age
+
+        # 304 if the screen has this version of the file, whether it asks for a range or not
+        return response.make_conditional(flask.request)
+
+    def _read_range(self, path: Path, start: int, stop: int) -> Iterator[bytes]:
+        with path.open('rb') as f:
+            f.seek(start)
+            remaining = stop - start
+
+            while remaining > 0:
+                chunk = f.read(min(self.stream_chunk_size, remaining))
+                if not chunk:
+                    break
+
+                remaining -= len(chunk)
+                yield chunk
+
+    # files are sent with an etag from their modification time and size, and 304 if it matches
+    @staticmethod
+    def _send_file(directory, file_name: str, max_age: int) -> flask.Response:
+        response = flask.send_from_directory(str(directory), file_name, conditional=True)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+
+        return response
 
 
 class FlaskIOServer(flask_socketio.Namespace):
@@ -70,6 +357,15 @@ class FlaskIOServer(flask_socketio.Namespace):
         super().__init__()
         self._socket_io = socket_io
         self._connections = dict()
+        self._revision_event_handler = lambda room: None
+
+    @property
+    def revision_event_handler(self) -> Callable[[str], Optional[str]]:
+        return self._revision_event_handler
+
+    @revision_event_handler.setter
+    def revision_event_handler(self, new_handler: Callable[[str], Optional[str]]) -> None:
+        self._revision_event_handler = new_handler
 
     def on_connect(self):
         return True
@@ -92,8 +388,17 @@ class FlaskIOServer(flask_socketio.Namespace):
 
         self._connections[room_name] += 1
 
+        # the page of the screen is reloaded if it is not the current one, e.g. a scene was shown while disconnected
+        revision = data.get('revision')
+        current_revision = self._revision_event_handler(room_name)
+        if revision is not None and current_revision is not None and revision != current_revision:
+            flask_socketio.emit('redirect', {'to': room_name})
+
     def request_redirect(self, from_channel: str, to_channel: str):
-        self._socket_io.emit('redirect', {'to': to_channel}, room=from_channel, broadcast=True)
+        self._socket_io.emit('redirect', {'to': to_channel}, room=from_channel)
+
+    def request_update(self, channel: str, update: dict):
+        self._socket_io.emit('update', update, room=channel)
 
     def get_connections(self, room_id: str):
         if room_id not in self._connections.keys():
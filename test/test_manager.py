@@ -1,24 +1,33 @@
+import io
+import json
+import os
+import shutil
 import sys
+import gc
+import tempfile
+import tracemalloc
+import weakref
 
 import unittest
+from datetime import datetime, time
 from pathlib import Path
+from time import sleep
 
-from controller.manager import ObjectManager, TemplateManager, SignageManager, ChannelManager, MultimediaManager
-from webserver.web_server import WebServer
+from controller.data_export import export_records, export_jsonl, import_jsonl
+from controller.manager import ObjectManager, MultimediaManager, load_managers
+from controller.scheduler import ScheduleWatcher
+from model.data_type import FieldKind, StringDataType, IntegerDataType, ListDataType
+from model.signage import Schedule, ScheduleType
+from model.template import template_cache
+from utils import persistence
+from utils.persistence import WriteBehindWriter, read_json_files, write_atomic
+from webserver.asset_pipeline import AssetPipeline, get_resource_urls
+from webserver.web_server import WebServer, get_update
 
 sys.path.append("../src")
 root_path = Path('../data').resolve()
 
-mtm_mng = MultimediaManager(root_path / 'media')
-obj_mng = ObjectManager(root_path / 'data', mtm_mng)
-tpl_mng = TemplateManager(root_path / 'template', obj_mng)
-sgn_mng = SignageManager(root_path / 'signage', obj_mng, tpl_mng)
-chn_mng = ChannelManager(root_path / 'channel', sgn_mng)
-
-mtm_mng.bind_managers(sgn_mng, obj_mng)
-obj_mng.bind_managers(tpl_mng, sgn_mng)
-tpl_mng.bind_managers(sgn_mng)
-sgn_mng.bind_managers(chn_mng)
+mtm_mng, obj_mng, tpl_mng, sgn_mng, chn_mng = load_managers(root_path)
 
 
 class TestChannelManager(unittest.TestCase):
@@ -45,6 +54,290 @@ class TestObjectManager(unittest.TestCase):
         drinks_object.set_value('name', 'test')
         drinks_object.set_value('name', 'Drinks')
 
+    def test_references(self):
+        menu_item_type = obj_mng.get_object_type('menu_item')
+        menu_group_type = obj_mng.get_object_type('menu_group')
+        milk_object = obj_mng.get_object_value(menu_item_type, 'milk')
+        drinks_object = obj_mng.get_object_value(menu_group_type, 'drinks')
+
+        self.assertEqual(obj_mng.get_value_references(milk_object), {'object/menu_group.drinks': drinks_object})
+        self.assertEqual(obj_mng.get_type_references(menu_item_type), {'type/menu_group': menu_group_type})
+        self.assertIn('signage/default_signage.scene0', sgn_mng.get_value_references(drinks_object))
+        self.assertEqual(set(tpl_mng.get_type_references(menu_group_type).keys()), {'scene/menu_group_scene'})
+
+    def test_schema(self):
+        menu_group_type = obj_mng.get_object_type('menu_group')
+        schema = menu_group_type.schema
+
+        self.assertIs(schema['menus'].kind, FieldKind.OBJECT_LIST)
+        self.assertIs(schema['name'].kind, FieldKind.PRIMITIVE)
+        self.assertEqual(menu_group_type.reference_fields, {'menus'})
+
+        with self.assertRaises(TypeError):
+            schema['name'] = schema['digits']
+
+    def test_shared_handlers(self):
+        menu_item_type = obj_mng.get_object_type('menu_item')
+        milk_object = obj_mng.get_object_value(menu_item_type, 'milk')
+        americano_object = obj_mng.get_object_value(menu_item_type, 'americano')
+
+        self.assertIs(milk_object.on_value_change, americano_object.on_value_change)
+        self.assertFalse(hasattr(milk_object, '__dict__'))
+
+    def test_cached_values(self):
+        menu_item_type = obj_mng.get_object_type('menu_item')
+        menu_group_type = obj_mng.get_object_type('menu_group')
+        milk_object = obj_mng.get_object_value(menu_item_type, 'milk')
+        drinks_object = obj_mng.get_object_value(menu_group_type, 'drinks')
+
+        values = drinks_object.get_values()
+        self.assertIs(drinks_object.get_values(), values)
+
+        # a change of an embedded value invalidates the cache of the embedding value
+        price = milk_object.get_value('price')
+        milk_object.set_value('price', price + 100)
+        try:
+            self.assertIsNot(drinks_object.get_values(), values)
+            self.assertIn(price + 100, [x['price'] for x in drinks_object.get_values()['menus']])
+
+            milk_object.id = 'test'
+            self.assertIn('test', drinks_object.get_values(False)['menus'])
+        finally:
+            milk_object.id = 'milk'
+            milk_object.set_value('price', price)
+
+
+class TestBulkChanges(unittest.TestCase):
+    def test_bulk_upsert(self):
+        menu_item_type = obj_mng.get_object_type('menu_item')
+        milk_object = obj_mng.get_object_value(menu_item_type, 'milk')
+        price = milk_object.get_value('price')
+        americano_values = obj_mng.get_object_value(menu_item_type, 'americano').get_values(False)
+
+        obj_mng.flush()
+        writes = obj_mng.writer.writes
+
+        summary = obj_mng.bulk_upsert(menu_item_type, [
+            {'id': 'milk', 'price': price + 100},
+            dict(americano_values, id='americano'),
+            {'id': 'tea', 'name': 'Tea', 'price': 300},
+            {'id': 'juice', 'name': 'Juice', 'price': -1},
+            {'id': 'coke', 'size': 'large'},
+            {'name': 'Water'},
+        ])
+
+        self.assertEqual(summary.added, ['tea'])
+        self.assertEqual(summary.updated, ['milk'])
+        self.assertEqual(summary.unchanged, ['americano'])
+        self.assertEqual(set(summary.invalid.keys()), {'juice', 'coke', '#5'})
+        self.assertEqual(milk_object.get_value('price'), price + 100)
+        self.assertEqual(obj_mng.writer.writes, writes + 2)  # written once at the end
+
+        summary = obj_mng.bulk_delete(menu_item_type, ['tea', 'milk', 'water'])
+        self.assertEqual(summary.deleted, ['tea'])
+        self.assertEqual(set(summary.invalid.keys()), {'milk', 'water'})
+        self.assertFalse((obj_mng.root_dir / 'menu_item' / 'tea.json').exists())
+
+        milk_object.set_value('price', price)
+
+
+class TestValidation(unittest.TestCase):
+    def test_validators(self):
+        string_type = StringDataType('a', max_length=3, one_of=['a', 'b', 'long'])
+        self.assertEqual(string_type.validate_batch(['a', 'b', 'c', 'long']), [2, 3])
+
+        # validators are compiled again when constraints are changed
+        string_type.one_of = ['a', 'c']
+        self.assertEqual(string_type.validate_batch(['a', 'b', 'c']), [1])
+
+        integer_type = IntegerDataType(0, 0, 10)
+        list_type = ListDataType(integer_type, 0, 5)
+        self.assertTrue(list_type.is_valid([0, 5, 10]))
+
+        integer_type.max = 5
+        self.assertFalse(list_type.is_valid([0, 5, 10]))
+
+
+class TestLazyValues(unittest.TestCase):
+    def test_lazy_values(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data_path = Path(temp_dir) / 'data'
+            obj_mng.flush()
+            shutil.copytree(str(obj_mng.root_dir), str(data_path))
+
+            # an invalid price fails on access, not on loading
+            with (data_path / 'menu_item' / 'milk.json').open('w', encoding='UTF-8') as f:
+                json.dump({'name': 'Milk', 'price': -1}, f)
+
+            lazy_obj_mng = ObjectManager(data_path, mtm_mng, lazy_values=True)
+            menu_item_type = lazy_obj_mng.get_object_type('menu_item')
+            milk_object = lazy_obj_mng.get_object_value(menu_item_type, 'milk')
+
+            self.assertEqual(milk_object.get_values(False), {'name': 'Milk', 'price': -1})
+            self.assertEqual(milk_object.get_value('name'), 'Milk')
+            self.assertRaises(AttributeError, milk_object.get_value, 'price')
+
+            # references are resolved on loading
+            self.assertTrue(lazy_obj_mng.get_value_references(milk_object))
+
+
+class TestTypeLoading(unittest.TestCase):
+    def test_sort_types(self):
+        def manifest(*type_ids):
+            return {'fields': {x: ['', '', {'type': x}] for x in type_ids}}
+
+        manifests = {
+            'group': manifest('[0,20]$item', 'str'),
+            'item': manifest('str'),
+            'left': manifest('$right'),
+            'right': manifest('[0,1]$left'),
+            'orphan': manifest('$unknown'),
+            'orphan_user': manifest('$orphan')
+        }
+
+        self.assertEqual(ObjectManager.sort_types(manifests), ['item', 'group'])
+
+    def test_load_cyclic_types(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data_path = Path(temp_dir)
+            for type_id, field_type in [('left', '$right'), ('right', '$left'), ('item', 'int')]:
+                (data_path / type_id).mkdir()
+                with (data_path / type_id / 'manifest.json').open('w') as f:
+                    json.dump({'name': type_id, 'fields': {'value': ['', '', {'type': field_type}]}}, f)
+
+            cyclic_obj_mng = ObjectManager(data_path, mtm_mng)
+            self.assertEqual(set(cyclic_obj_mng.object_types.keys()), {'item'})
+
+
+class TestPersistence(unittest.TestCase):
+    def test_write_behind(self):
+        menu_item_type = obj_mng.get_object_type('menu_item')
+        milk_object = obj_mng.get_object_value(menu_item_type, 'milk')
+        milk_path = obj_mng.root_dir / 'menu_item' / 'milk.json'
+
+        obj_mng.flush()
+        writes = obj_mng.writer.writes
+
+        # repeated changes are written once
+        for price in range(100, 110):
+            milk_object.set_value('price', price)
+
+        obj_mng.flush()
+        self.assertEqual(obj_mng.writer.writes, writes + 1)
+
+        with milk_path.open(encoding='UTF-8') as f:
+            self.assertEqual(json.load(f)['price'], 109)
+
+        milk_object.set_value('price', 299)
+        obj_mng.flush()
+        self.assertEqual([x.name for x in milk_path.parent.iterdir() if x.name.endswith('.tmp')], [])
+
+    def test_write_retry(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            writer = WriteBehindWriter(delay=0.01)
+            path = Path(temp_dir) / 'missing' / 'value.json'
+
+            # a file failed to be written is kept, and written by the next flush
+            writer.schedule(path, '{}')
+            with self.assertRaises(OSError):
+                writer.flush()
+            self.assertEqual(writer.pending, 1)
+
+            path.parent.mkdir()
+            writer.flush()
+            self.assertEqual(path.read_text(), '{}')
+            self.assertEqual(writer.pending, 0)
+
+            # an idle writer is not kept alive by its thread
+            writer_ref = weakref.ref(writer)
+            sleep(0.1)
+            del writer
+            gc.collect()
+            self.assertIsNone(writer_ref())
+
+    def test_read_json_files(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [Path(temp_dir) / 'value{}.json'.format(x) for x in range(200)]
+            for index, path in enumerate(paths):
+                with path.open('w') as f:
+                    json.dump({'index': index}, f)
+
+            self.assertEqual([x['index'] for x in read_json_files(paths, 4, 16)], list(range(200)))
+            self.assertEqual([x['index'] for x in read_json_files(paths, 1)], list(range(200)))
+
+            # a server of green threads reads chunks on its pool of real threads
+            calls = []
+            persistence.set_blocking_call(lambda function, *x: calls.append(function) or function(*x))
+            try:
+                self.assertEqual([x['index'] for x in read_json_files(paths, 4, 16)], list(range(200)))
+            finally:
+                persistence.set_blocking_call(None)
+            self.assertEqual(len(calls), 13)
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data_path = Path(temp_dir) / 'data'
+            obj_mng.flush()
+            shutil.copytree(str(obj_mng.root_dir), str(data_path))
+            milk_path = data_path / 'menu_item' / 'milk.json'
+
+            def load_price():
+                snapshot_obj_mng = ObjectManager(data_path, mtm_mng, use_snapshot=True)
+                menu_item_type = snapshot_obj_mng.get_object_type('menu_item')
+                return snapshot_obj_mng.get_object_value(menu_item_type, 'milk').get_value('price')
+
+            price = load_price()
+            self.assertTrue(data_path.with_name('data.snapshot').exists())
+
+            with milk_path.open(encoding='UTF-8') as f:
+                milk_content = json.load(f)
+
+            # a file edited in place is loaded again, though its directory is not changed
+            with milk_path.open('w', encoding='UTF-8') as f:
+                json.dump(dict(milk_content, price=price + 1), f)
+            self.assertEqual(load_price(), price + 1)
+
+            write_atomic(milk_path, json.dumps(dict(milk_content, price=price + 2)))
+            self.assertEqual(load_price(), price + 2)
+
+    def test_export_import(self):
+        stream = io.StringIO()
+        count = export_jsonl(stream, export_records(obj_mng, tpl_mng, sgn_mng, chn_mng))
+        self.assertEqual(len(stream.getvalue().splitlines()), count)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            new_root = Path(temp_dir)
+            stream.seek(0)
+            counts = import_jsonl(stream, new_root, chunk_size=2)
+            self.assertEqual(counts['channel'], len(chn_mng.channels))
+
+            # media files are not exported
+            shutil.rmtree(str(new_root / 'media'))
+            shutil.copytree(str(mtm_mng.root_path), str(new_root / 'media'))
+
+            _, new_obj_mng, new_tpl_mng, new_sgn_mng, new_chn_mng = load_managers(new_root)
+
+            for type_id, type_instance in obj_mng.object_types.items():
+                new_type = new_obj_mng.get_object_type(type_id)
+                self.assertEqual({x: y.get_values(False) for x, y in obj_mng.get_object_values(type_instance).items()},
+                                 {x: y.get_values(False) for x, y in new_obj_mng.get_object_values(new_type).items()})
+
+            self.assertEqual(set(new_tpl_mng.scene_templates.keys()), set(tpl_mng.scene_templates.keys()))
+            self.assertEqual({x: y.to_dict() for x, y in new_sgn_mng.signages.items()},
+                             {x: y.to_dict() for x, y in sgn_mng.signages.items()})
+            self.assertEqual({x: y.to_dict() for x, y in new_chn_mng.channels.items()},
+                             {x: y.to_dict() for x, y in chn_mng.channels.items()})
+
+            # the page of a signage is exported with its libraries
+            self.assertTrue((new_root / 'signage' / 'vendor' / 'manifest.json').exists())
+            self.assertEqual(new_chn_mng.get_channel('default_channel').signage.render(new_sgn_mng.root_dir),
+                             chn_mng.get_channel('default_channel').signage.render(sgn_mng.root_dir))
+
+            # ids must not point outside of the directory
+            with self.assertRaises(AttributeError):
+                import_jsonl(io.StringIO('{"kind": "header", "version": 1}\n'
+                                         '{"kind": "channel", "id": "../escape", "data": {}}\n'), new_root)
+
 
 class TemplateManager(unittest.TestCase):
     def test_template_manager(self):
@@ -55,6 +348,28 @@ class TemplateManager(unittest.TestCase):
         self.assertRaises(ReferenceError, tpl_mng.remove_frame_template, bottom_clock)
 
 
+class TestTemplateCache(unittest.TestCase):
+    def test_template_cache(self):
+        empty_scene = tpl_mng.get_scene_template('empty_scene')
+        template_path = empty_scene.root_dir / 'empty_scene.html'
+
+        empty_scene.render({})
+        hits, misses = template_cache.hits, template_cache.misses
+
+        empty_scene.render({})
+        self.assertEqual(template_cache.hits, hits + 1)
+        self.assertEqual(template_cache.misses, misses)
+
+        # modification time is changed -> compile the template again
+        stat = template_path.stat()
+        os.utime(str(template_path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        try:
+            empty_scene.render({})
+            self.assertEqual(template_cache.misses, misses + 1)
+        finally:
+            os.utime(str(template_path), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
 class TestSignageManager(unittest.TestCase):
     def test_signage_change(self):
         default_signage = sgn_mng.get_signage('default_signage')
@@ -75,11 +390,389 @@ class TestSignageManager(unittest.TestCase):
         default_signage.id = 'default_signage'
 
 
+class TestSignageRender(unittest.TestCase):
+    def test_render_cache(self):
+        default_signage = sgn_mng.get_signage('default_signage')
+
+        page = default_signage.render(sgn_mng.root_dir)
+        self.assertIs(default_signage.render(sgn_mng.root_dir), page)
+
+        # changes on a scene invalidate the rendered page
+        version = default_signage.version
+        default_signage.scenes[0].values.set_value('bullet', '#')
+        self.assertGreater(default_signage.version, version)
+
+        changed_page = default_signage.render(sgn_mng.root_dir)
+        self.assertIn('# Milk', changed_page)
+
+        default_signage.scenes[0].values.set_value('bullet', '\u2605')
+        self.assertEqual(default_signage.render(sgn_mng.root_dir), page)
+
+    def test_schedule(self):
+        schedule = Schedule(ScheduleType.VISIBLE_ON_TIME)
+        schedule.from_time = time(9, 0, 0)
+        schedule.to_time = time(17, 0, 0)
+        schedule.day_of_week = [False, True, True, True, True, True, False]  # Sun ~ Sat
+
+        monday = datetime(2017, 6, 5, 10, 0, 0)
+        self.assertTrue(schedule.is_visible(monday))
+        self.assertTrue(schedule.is_visible(monday.replace(hour=17, microsecond=500000)))
+        self.assertFalse(schedule.is_visible(monday.replace(hour=8)))
+        self.assertFalse(schedule.is_visible(datetime(2017, 6, 10, 10, 0, 0)))  # saturday
+
+        self.assertEqual(schedule.next_change(monday), datetime(2017, 6, 5, 17, 0, 1))
+        self.assertEqual(schedule.next_change(datetime(2017, 6, 9, 18, 0, 0)), datetime(2017, 6, 12, 9, 0, 0))
+
+        schedule.type = ScheduleType.HIDDEN_ON_TIME
+        self.assertFalse(schedule.is_visible(monday))
+        self.assertEqual(schedule.next_change(monday), datetime(2017, 6, 5, 17, 0, 1))
+
+        schedule.day_of_week = [False] * 7
+        self.assertIsNone(schedule.next_change(monday))
+
+        schedule.type = ScheduleType.ALWAYS_HIDDEN
+        self.assertFalse(schedule.is_visible(monday))
+        self.assertIsNone(schedule.next_change(monday))
+
+    def test_render_visible_scenes(self):
+        default_signage = sgn_mng.get_signage('default_signage')
+        empty_schedule = default_signage.scenes[1].schedule
+
+        from_time, to_time = empty_schedule.from_time, empty_schedule.to_time
+
+        # an always hidden scene is not rendered
+        self.assertNotIn('EMPTY!', default_signage.render(sgn_mng.root_dir))
+        self.assertIsNone(default_signage.next_change(datetime.now()))
+
+        empty_schedule.type = ScheduleType.VISIBLE_ON_TIME
+        empty_schedule.from_time = time(9, 0, 0)
+        empty_schedule.to_time = time(17, 0, 0)
+
+        try:
+            morning = datetime(2017, 6, 5, 8, 0, 0)
+            self.assertEqual(default_signage.next_change(morning), datetime(2017, 6, 5, 9, 0, 0))
+
+            page = default_signage.render(sgn_mng.root_dir, moment=morning)
+            self.assertNotIn('EMPTY!', page)
+            self.assertIn(str(int(datetime(2017, 6, 5, 9, 0, 0).timestamp() * 1000)), page)
+
+            # the page is cached until the next change
+            self.assertIs(default_signage.render(sgn_mng.root_dir, moment=morning.replace(minute=59)), page)
+            self.assertIn('EMPTY!', default_signage.render(sgn_mng.root_dir, moment=morning.replace(hour=9)))
+        finally:
+            empty_schedule.from_time = from_time
+            empty_schedule.to_time = to_time
+            empty_schedule.type = ScheduleType.ALWAYS_HIDDEN
+
+    def test_render_resources(self):
+        page = sgn_mng.get_signage('default_signage').render(sgn_mng.root_dir)
+        head, body = page.split('</head>')
+
+        # menu_group_scene is used twice, but its style is linked once in the head
+        self.assertEqual(page.count('/_/scene/menu_group_scene/style.css'), 1)
+        self.assertIn('/_/scene/menu_group_scene/style.css', head)
+        self.assertIn('<script defer src="/_/frame/bottom_clock/current_time.js">', head)
+        self.assertEqual(get_resource_urls(body), [])
+
+
+class TestScheduleWatcher(unittest.TestCase):
+    def test_refresh_on_change(self):
+        default_signage = sgn_mng.get_signage('default_signage')
+        empty_schedule = default_signage.scenes[1].schedule
+        from_time, to_time = empty_schedule.from_time, empty_schedule.to_time
+
+        now = datetime(2017, 6, 5, 8, 0, 0)
+        watcher = ScheduleWatcher(sgn_mng, chn_mng, clock=lambda: now)
+
+        refreshed = []
+        redirect_event_handler = chn_mng.redirect_event_handler
+        chn_mng.redirect_event_handler = lambda channel, old_id: refreshed.append(channel.id)
+
+        watcher.start()
+        try:
+            self.assertIsNone(watcher.next_change)
+
+            # a changed signage is scheduled again
+            empty_schedule.type = ScheduleType.VISIBLE_ON_TIME
+            empty_schedule.from_time = time(9, 0, 0)
+            empty_schedule.to_time = time(17, 0, 0)
+            self.assertEqual(watcher.next_change, datetime(2017, 6, 5, 9, 0, 0))
+
+            refreshed.clear()
+            self.assertEqual(watcher.run_pending(datetime(2017, 6, 5, 8, 59, 59)), [])
+            self.assertEqual(refreshed, [])
+
+            self.assertEqual(watcher.run_pending(datetime(2017, 6, 5, 9, 0, 0)), [default_signage])
+            self.assertEqual(sorted(refreshed), ['default_channel', 'default_channel_2'])
+            self.assertEqual(watcher.next_change, datetime(2017, 6, 5, 17, 0, 1))
+
+            # a signage failing to refresh is scheduled again
+            def fail(channel, old_id):
+                raise RuntimeError()
+
+            chn_mng.redirect_event_handler = fail
+            self.assertEqual(watcher.run_pending(datetime(2017, 6, 5, 17, 0, 1)), [default_signage])
+            self.assertEqual(watcher.next_change, datetime(2017, 6, 6, 9, 0, 0))
+            chn_mng.redirect_event_handler = lambda channel, old_id: refreshed.append(channel.id)
+
+            empty_schedule.type = ScheduleType.ALWAYS_HIDDEN
+            self.assertIsNone(watcher.next_change)
+        finally:
+            watcher.stop()
+            chn_mng.redirect_event_handler = redirect_event_handler
+            empty_schedule.from_time = from_time
+            empty_schedule.to_time = to_time
+            empty_schedule.type = ScheduleType.ALWAYS_HIDDEN
+            empty_schedule.type = ScheduleType.ALWAYS_HIDDEN
+
+
+class TestDependencyTracking(unittest.TestCase):
+    def test_value_change_propagation(self):
+        menu_item_type = obj_mng.get_object_type('menu_item')
+        milk_object = obj_mng.get_object_value(menu_item_type, 'milk')
+        default_signage = sgn_mng.get_signage('default_signage')
+
+        dependents = obj_mng.dependency_graph.get_dependents(milk_object, True)
+        self.assertIn(default_signage, dependents)
+
+        refreshed = []
+        redirect_event_handler = chn_mng.redirect_event_handler
+        chn_mng.redirect_event_handler = lambda channel, old_id: refreshed.append(channel.id)
+
+        try:
+            default_signage.render(sgn_mng.root_dir)
+            version = default_signage.version
+
+            milk_object.set_value('price', 199)
+            self.assertGreater(default_signage.version, version)
+            self.assertIn('Milk - $1.99', default_signage.render(sgn_mng.root_dir))
+            self.assertEqual(sorted(refreshed), ['default_channel', 'default_channel_2'])
+        finally:
+            chn_mng.redirect_event_handler = redirect_event_handler
+            milk_object.set_value('price', 299)
+
+
 class TestWebServer(unittest.TestCase):
     def test_start(self):
         server = WebServer(chn_mng, obj_mng, tpl_mng, sgn_mng, mtm_mng)
         server.start()  # todo: causes infinite loop
 
+    def test_conditional_get(self):
+        client = WebServer(chn_mng, obj_mng, tpl_mng, sgn_mng, mtm_mng).app.test_client()
+
+        response = client.get('/default_channel')
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+
+        response = client.get('/default_channel', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+        # a change of an embedded value changes the page
+        milk_object = obj_mng.get_object_value(obj_mng.get_object_type('menu_item'), 'milk')
+        price = milk_object.get_value('price')
+        milk_object.set_value('price', price + 1)
+
+        response = client.get('/default_channel', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        milk_object.set_value('price', price)
+
+        for url in ['/_/scene/empty_scene/style.css', '/_/image/placeholder.jpg']:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('max-age', response.headers['Cache-Control'])
+            response.close()
+
+            response = client.get(url, headers={'If-None-Match': response.headers['ETag']})
+            self.assertEqual(response.status_code, 304)
+            response.close()
+
+    def test_asset_bundles(self):
+        server = WebServer(chn_mng, obj_mng, tpl_mng, sgn_mng, mtm_mng)
+        client = server.app.test_client()
+        page = client.get('/default_channel').data.decode('UTF-8')
+
+        # files of templates are bundled. libraries are not downloaded, so they are loaded from CDNs.
+        self.assertNotIn('/_/scene/menu_group_scene/style.css', page)
+        self.assertIn('code.jquery.com', page)
+
+        bundle_urls = [x for x in get_resource_urls(page) if x.startswith(AssetPipeline.url_prefix)]
+        self.assertEqual(len(bundle_urls), 2)
+
+        for url in bundle_urls:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            self.assertEqual(client.get(url, headers={'If-None-Match': response.headers['ETag']}).status_code, 304)
+
+        self.assertIn(b'.menu_group_scene{', client.get(next(x for x in bundle_urls if x.endswith('.css'))).data)
+
+        # scripts are bundled from the templates of a page, not from every template
+        self.assertIn(b'current_time', client.get(next(x for x in bundle_urls if x.endswith('.js'))).data)
+        self.assertEqual(server.asset_pipeline.strip_bundled(
+            '<link rel="stylesheet" type="text/css" href="/_/scene/menu_group_scene/style.css"/>'), '')
+        self.assertEqual(client.get(AssetPipeline.url_prefix + 'missing.css').status_code, 404)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            vendor_path = Path(temp_dir) / 'vendor'
+            vendor_path.mkdir()
+
+            with (vendor_path / 'manifest.json').open('w', encoding='UTF-8') as f:
+                json.dump({'styles': [], 'scripts': [{'file': 'lib.js', 'url': 'https://example.com/lib.js'}]}, f)
+            (vendor_path / 'lib.js').write_text('var lib = {\n    a: 1\n}\n', encoding='UTF-8')
+
+            pipeline = AssetPipeline(Path(temp_dir), tpl_mng)
+            pipeline.build()
+
+            self.assertNotIn('example.com', pipeline.head_tags)
+            vendor_name = get_resource_urls(pipeline.head_tags)[-1][len(AssetPipeline.url_prefix):]
+            self.assertEqual(pipeline.get_bundle(vendor_name).content, b'var lib = {\na: 1\n}')
+
+            # a changed file is bundled again under a new name
+            self.assertFalse(pipeline.refresh())
+            (vendor_path / 'lib.js').write_text('var lib = 2;\n', encoding='UTF-8')
+            pipeline.check_interval = 0
+            self.assertTrue(pipeline.refresh())
+            self.assertIsNone(pipeline.get_bundle(vendor_name))
+            self.assertNotIn(vendor_name, pipeline.head_tags)
+
+            # without a manifest, the libraries of the page are loaded from CDNs
+            (vendor_path / 'manifest.json').unlink()
+            pipeline.build()
+            self.assertIn('code.jquery.com', pipeline.head_tags)
+
+    def test_sync(self):
+        client = WebServer(chn_mng, obj_mng, tpl_mng, sgn_mng, mtm_mng).app.test_client()
+        milk_object = obj_mng.get_object_value(obj_mng.get_object_type('menu_item'), 'milk')
+
+        # values in memory are changed, not only their files
+        try:
+            response = client.post('/_/sync/menu_item?format=csv', data='id,price\nmilk,199\n')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['updated'], ['milk'])
+            self.assertEqual(milk_object.get_value('price'), 199)
+        finally:
+            milk_object.set_value('price', 299)
+
+        self.assertEqual(client.post('/_/sync/missing', data='').status_code, 404)
+        self.assertEqual(client.post('/_/sync/menu_item', data='{"id": "milk", "price": 299}\n',
+                                     environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code, 403)
+
+    def test_partial_update(self):
+        server = WebServer(chn_mng, obj_mng, tpl_mng, sgn_mng, mtm_mng)
+        server.update_delay = 0
+        page = server.app.test_client().get('/default_channel').data.decode('UTF-8')
+
+        io_client = server.socket_io.test_client(server.app)
+        io_client.emit('enter', {'room': 'default_channel'})
+
+        milk_object = obj_mng.get_object_value(obj_mng.get_object_type('menu_item'), 'milk')
+        revision = sgn_mng.get_signage('default_signage').render_parts()['revision']
+        self.assertIn("'{}'".format(revision), page)
+
+        try:
+            milk_object.set_value('price', 199)
+
+            received = []
+            for _ in range(100):
+                received = io_client.get_received()
+                if received:
+                    break
+                server.socket_io.sleep(0.01)
+
+            # only the scene showing the price is sent
+            self.assertEqual([x['name'] for x in received], ['update'])
+            update = received[0]['args'][0]
+            self.assertEqual(update['from'], revision)
+            self.assertEqual(list(update['scenes'].keys()), ['0'])
+            self.assertIn('Milk - $1.99', update['scenes']['0'])
+            self.assertNotIn('frame', update)
+            self.assertLess(len(json.dumps(update)), len(page) / 2)
+        finally:
+            io_client.disconnect()
+            milk_object.set_value('price', 299)
+
+        # a screen which missed an update while disconnected is reloaded when it connects again
+        # an update of the restored price may be received too
+        io_client = server.socket_io.test_client(server.app)
+        io_client.emit('enter', {'room': 'default_channel', 'revision': update['to']})
+        self.assertIn({'to': 'default_channel'}, [x['args'][0] for x in io_client.get_received()
+                                                  if x['name'] == 'redirect'])
+        io_client.emit('enter', {'room': 'default_channel', 'revision': revision})
+        self.assertNotIn('redirect', [x['name'] for x in io_client.get_received()])
+        io_client.disconnect()
+
+        # a page is reloaded if a new template needs its files
+        parts = sgn_mng.get_signage('default_signage').render_parts()
+        self.assertIsNone(get_update(dict(parts, resources=[]), parts))
+        self.assertEqual(get_update(parts, dict(parts, scenes=[], durations=[], revision='0')),
+                         {'from': parts['revision'], 'to': '0', 'scenes': {}, 'scene_count': 0, 'durations': []})
+        self.assertEqual(get_update(parts, dict(parts, next_change=0))['next_change'], 0)
+
+    def test_video_range(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            media_path = Path(temp_dir)
+            (media_path / 'image').mkdir()
+            (media_path / 'video').mkdir()
+
+            # 32 MiB with a byte pattern to check offsets
+            size = 32 * 1024 * 1024
+            pattern = bytes(range(256)) * 4096
+            with (media_path / 'video' / 'large.mp4').open('wb') as f:
+                for _ in range(size // len(pattern)):
+                    f.write(pattern)
+
+            video_mtm_mng = MultimediaManager(media_path)
+            client = WebServer(chn_mng, obj_mng, tpl_mng, sgn_mng, video_mtm_mng).app.test_client()
+
+            response = client.get('/_/video/large.mp4', headers={'Range': 'bytes=1000-1999'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.headers['Content-Range'], 'bytes 1000-1999/{}'.format(size))
+            self.assertEqual(response.data, bytes(x % 256 for x in range(1000, 2000)))
+
+            response = client.get('/_/video/large.mp4', headers={'Range': 'bytes=-10'})
+            self.assertEqual(response.headers['Content-Range'], 'bytes {}-{}/{}'.format(size - 10, size - 1, size))
+            self.assertEqual(response.data, bytes(range(246, 256)))
+
+            response = client.get('/_/video/large.mp4', headers={'Range': 'bytes={}-'.format(size)})
+            self.assertEqual(response.status_code, 416)
+
+            # a screen having the file revalidates it with the etag it received
+            response = client.get('/_/video/large.mp4', buffered=False)
+            etag = response.headers['ETag']
+            response.close()
+            for headers in [{'If-None-Match': etag}, {'If-None-Match': etag, 'Range': 'bytes=0-9'}]:
+                response = client.get('/_/video/large.mp4', headers=headers)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.data, b'')
+
+            # multiple ranges are not supported. the whole file is sent.
+            response = client.get('/_/video/large.mp4', headers={'Range': 'bytes=0-9,20-29'}, buffered=False)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['Content-Length'], str(size))
+            self.assertEqual(response.headers['ETag'], etag)
+            response.close()
+
+            # a range of an older version of the file is not sent
+            response = client.get('/_/video/large.mp4', headers={'Range': 'bytes=0-9', 'If-Range': '"old"'})
+            self.assertEqual(response.status_code, 200)
+            response.close()
+
+            self.assertEqual(client.get('/_/video/missing.mp4').status_code, 404)
+
+            # the file is streamed, not loaded into memory
+            tracemalloc.start()
+            response = client.get('/_/video/large.mp4', headers={'Range': 'bytes=0-'}, buffered=False)
+            received = sum(len(x) for x in response.response)
+            response.close()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            self.assertEqual(received, size)
+            self.assertLess(peak, size // 8)
+
 
 class TestMultimedia(unittest.TestCase):
     def test_file_change(self):